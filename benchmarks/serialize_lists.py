@@ -0,0 +1,80 @@
+"""
+Rows per second of the list serialization, before and after the column-tuple path:
+
+    python benchmarks/serialize_lists.py [--rows 5000] [--repeat 5]
+
+"before" loads ORM instances, calls serialize() on each and encodes the list with
+the stdlib json module, as the list endpoints used to; "after" is what they do now,
+plain column tuples from select_fields() encoded by the app's JSON provider
+(orjson when it is installed). Runs against a throwaway SQLite file.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+DATABASE = os.path.join(tempfile.mkdtemp(prefix='bench-serialize-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+os.environ['CACHE_BACKEND'] = 'memory'
+os.environ['ENABLE_ADMIN'] = '0'
+os.environ['METRICS_ENABLED'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from app import app  # noqa: E402
+from models import db, User, Character, Planet, Ship  # noqa: E402
+from utils import select_fields, serialize_rows, orjson  # noqa: E402
+
+def seed(rows):
+    db.create_all()
+    for index in range(rows):
+        db.session.add_all([
+            User(email=f'user{index}@example.com', password='secret', is_active=True),
+            Character(name=f'Character {index}', birth_year='19BBY', gender='n/a', height=str(100 + index % 100),
+                      skin_color='fair', eye_color='blue'),
+            Planet(name=f'Planet {index}', climate='arid', population=str(index * 1000), orbital_period='304',
+                   rotation_period='23', diameter='10465'),
+            Ship(name=f'Ship {index}', model='T-65', manufacturer='Incom', cost_in_credits='149999', crew='1'),
+        ])
+    db.session.commit()
+
+def before(model):
+    rows = model.query.order_by(model.id).all()
+    # Flask's default provider sorts the keys
+    return json.dumps(list(map(lambda row: row.serialize(), rows)), sort_keys=True)
+
+def after(model):
+    rows = select_fields(model).order_by(model.id).all()
+    return app.json.dumps(serialize_rows(rows))
+
+def rows_per_second(serialize, model, rows, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        serialize(model)
+        best = min(best, time.perf_counter() - started)
+        # drop the identity map so every run loads the rows again
+        db.session.remove()
+    return rows / best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000, help='rows per table')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best one is reported')
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.rows)
+        print(f'{args.rows} rows per table, JSON encoder: {"orjson" if orjson is not None else "stdlib json"}')
+        print(f'{"model":<10} {"before rows/s":>14} {"after rows/s":>14} {"speedup":>8}')
+        for model in (User, Character, Planet, Ship):
+            old = rows_per_second(before, model, args.rows, args.repeat)
+            new = rows_per_second(after, model, args.rows, args.repeat)
+            print(f'{model.__name__:<10} {old:>14,.0f} {new:>14,.0f} {new / old:>7.1f}x')
+        db.engine.dispose()
+    shutil.rmtree(os.path.dirname(DATABASE))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Reader and writer throughput on SQLite with the WAL/pragma profile versus the driver defaults:
+
+    python benchmarks/sqlite_wal.py [--readers 4] [--writers 2] [--seconds 5]
+
+Each mode runs in its own process (SQLITE_TUNING=0 then 1, the settings are read on
+import) against a fresh database file. Reader threads count rows matching a LIKE
+while writer threads insert and commit one row at a time, all through the app's
+session; "errors" are mostly "database is locked".
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+def measure(readers, writers, seconds):
+    from app import app
+    from models import db, Character
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(Character(name=f'Character {index}') for index in range(2000))
+        db.session.commit()
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def loop(work, counter):
+        with app.app_context():
+            while time.monotonic() < stop:
+                try:
+                    work()
+                    done = counter
+                except Exception:
+                    db.session.rollback()
+                    done = 'errors'
+                db.session.remove()
+                with lock:
+                    counts[done] += 1
+
+    def read():
+        db.session.execute(db.text("SELECT count(*) FROM character WHERE name LIKE 'Character 1%'")).all()
+
+    def write():
+        db.session.add(Character(name='written'))
+        db.session.commit()
+
+    threads = [threading.Thread(target=loop, args=(read, 'reads')) for _ in range(readers)]
+    threads += [threading.Thread(target=loop, args=(write, 'writes')) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+    return {'journal_mode': journal_mode, **{name: count / seconds for name, count in counts.items()}}
+
+def run(tuning, args):
+    directory = tempfile.mkdtemp(prefix='bench-sqlite-')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(directory, "bench.db")}', SQLITE_TUNING=tuning,
+               CACHE_BACKEND='memory', ENABLE_ADMIN='0', METRICS_ENABLED='0')
+    try:
+        output = subprocess.run([sys.executable, __file__, '--measure', str(args.readers), str(args.writers), str(args.seconds)],
+                                env=env, check=True, capture_output=True, text=True).stdout
+    finally:
+        shutil.rmtree(directory)
+    return json.loads(output.splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--measure', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        sys.path.insert(0, SRC)
+        readers, writers, seconds = args.measure
+        print(json.dumps(measure(int(readers), int(writers), float(seconds))))
+        return
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:g}s per mode')
+    print(f'{"profile":<10} {"journal":<8} {"reads/s":>10} {"writes/s":>10} {"errors/s":>10}')
+    for name, tuning in (('default', '0'), ('wal', '1')):
+        result = run(tuning, args)
+        print(f'{name:<10} {result["journal_mode"]:<8} {result["reads"]:>10,.0f} {result["writes"]:>10,.0f} {result["errors"]:>10,.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Cold start time and per-worker memory of the gunicorn deployment (Linux only):
+
+    python benchmarks/startup_memory.py [--workers 4]
+
+For each combination of GUNICORN_PRELOAD and ENABLE_ADMIN it times `import app` in a
+fresh interpreter, starts `gunicorn wsgi` with gunicorn.conf.py, times the first
+response, sends a few list requests, and reads the RSS and PSS of the workers from
+/proc/<pid>/smaps_rollup. PSS splits shared pages between the processes that map
+them, so it is what preloading saves.
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+
+def memory(pid):
+    """Rss and Pss of a process in MB."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        for line in smaps:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                values[name] = int(value.split()[0]) / 1024
+    return values
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def import_seconds(env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=SRC, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+def measure(env, workers):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    server = subprocess.Popen(['gunicorn', 'wsgi', '--chdir', './src/', '-w', str(workers), '-b', f'127.0.0.1:{port}'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            try:
+                urllib.request.urlopen(f'{base}/character?limit=1').read()
+                break
+            except OSError:
+                time.sleep(0.02)
+        first_response = time.perf_counter() - started
+        # let every worker boot and serve some requests before reading its memory
+        time.sleep(2)
+        for _ in range(10 * workers):
+            urllib.request.urlopen(f'{base}/character?limit=50').read()
+        with open(f'/proc/{server.pid}/task/{server.pid}/children') as children:
+            pids = [int(pid) for pid in children.read().split()]
+        samples = [memory(pid) for pid in pids]
+        return {
+            'first_response': first_response,
+            'rss': sum(sample['Rss'] for sample in samples) / len(samples),
+            'pss': sum(sample['Pss'] for sample in samples) / len(samples),
+            'total_pss': sum(sample['Pss'] for sample in samples) + memory(server.pid)['Pss'],
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-startup-')
+    print(f'{args.workers} workers, MB per worker are averages')
+    print(f'{"preload":<8} {"admin":<6} {"import ms":>10} {"first response ms":>18} {"rss MB":>8} {"pss MB":>8} {"total pss MB":>13}')
+    try:
+        base = dict(os.environ, CACHE_BACKEND='sqlite', CACHE_URL=os.path.join(directory, 'cache.db'),
+                    DATABASE_URL=f'sqlite:///{os.path.join(directory, "bench.db")}')
+        subprocess.run([sys.executable, '-c', 'from app import app, db\nwith app.app_context(): db.create_all()'],
+                       cwd=SRC, env=base, check=True)
+        for preload, admin in (('0', '1'), ('1', '1'), ('0', '0'), ('1', '0')):
+            env = dict(base, GUNICORN_PRELOAD=preload, ENABLE_ADMIN=admin)
+            imported = import_seconds(env)
+            result = measure(env, args.workers)
+            print(f'{preload:<8} {admin:<6} {imported * 1000:>10.0f} {result["first_response"] * 1000:>18.0f} '
+                  f'{result["rss"]:>8.1f} {result["pss"]:>8.1f} {result["total_pss"]:>13.1f}')
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Gunicorn settings, picked up from the working directory by `gunicorn wsgi --chdir ./src/`.
+
+GUNICORN_PRELOAD=1 imports the app once in the master so workers fork with the
+modules already loaded and share their memory pages; each worker then drops the
+database connections it inherited.
+
+The workers write their Prometheus samples to PROMETHEUS_MULTIPROC_DIR so /metrics
+reports the totals of all of them.
+"""
+import os
+import shutil
+import tempfile
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# must exist before prometheus_client is imported by the app, which preload_app
+# does ahead of the on_starting hook
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "api-metrics"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+def on_starting(server):
+    # samples left by a previous run would be added to the new ones
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+def when_ready(server):
+    if server.cfg.workers > 1 and os.getenv("CACHE_BACKEND") == "memory":
+        server.log.warning("CACHE_BACKEND=memory keeps a separate cache per worker, invalidations "
+                           "in one worker are not seen by the others; use sqlite or redis")
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from app import app
+    from database import dispose_engines
+    from models import db
+    dispose_engines(app, db)
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,37 @@
+"""unique (user_id, entity_id) indexes on the favorite tables
+
+Revision ID: b4f2d8e61a37
+Revises: 7c1e9a4d2b10
+Create Date: 2026-10-18 11:40:05.271948
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4f2d8e61a37'
+down_revision = '7c1e9a4d2b10'
+branch_labels = None
+depends_on = None
+
+FAVORITE_TABLES = (
+    ('favorite_character', 'character_id'),
+    ('favorite_planet', 'planet_id'),
+    ('favorite_ship', 'ship_id'),
+)
+
+
+def upgrade():
+    for table, column in FAVORITE_TABLES:
+        # keep the oldest row of every duplicated pair so the unique index can be built
+        op.execute(
+            f'DELETE FROM {table} WHERE id NOT IN ('
+            f'SELECT min_id FROM (SELECT min(id) AS min_id FROM {table} GROUP BY user_id, {column}) AS keep)'
+        )
+        op.create_index(f'uq_{table}_user_id_{column}', table, ['user_id', column], unique=True)
+
+
+def downgrade():
+    for table, column in FAVORITE_TABLES:
+        op.drop_index(f'uq_{table}_user_id_{column}', table_name=table)
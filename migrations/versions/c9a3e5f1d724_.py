@@ -0,0 +1,34 @@
+"""(column, id) indexes for filtering and sorting the resource lists
+
+Revision ID: c9a3e5f1d724
+Revises: b4f2d8e61a37
+Create Date: 2026-10-18 14:03:29.860412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9a3e5f1d724'
+down_revision = 'b4f2d8e61a37'
+branch_labels = None
+depends_on = None
+
+INDEXED_COLUMNS = (
+    ('character', ('name', 'birth_year', 'gender', 'skin_color', 'eye_color')),
+    ('planet', ('name', 'climate')),
+    ('ship', ('name', 'model', 'manufacturer')),
+)
+
+
+def upgrade():
+    for table, columns in INDEXED_COLUMNS:
+        for column in columns:
+            op.create_index(f'ix_{table}_{column}_id', table, [column, 'id'], unique=False)
+
+
+def downgrade():
+    for table, columns in INDEXED_COLUMNS:
+        for column in columns:
+            op.drop_index(f'ix_{table}_{column}_id', table_name=table)
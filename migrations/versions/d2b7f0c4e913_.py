@@ -0,0 +1,54 @@
+"""full-text search tables for character, planet and ship
+
+Revision ID: d2b7f0c4e913
+Revises: c9a3e5f1d724
+Create Date: 2026-10-18 16:25:51.093317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b7f0c4e913'
+down_revision = 'c9a3e5f1d724'
+branch_labels = None
+depends_on = None
+
+# kind -> (entity table, searched columns), keep in sync with src/search.py
+SEARCH_COLUMNS = {
+    'character': ('character', ('name',)),
+    'planet': ('planet', ('name',)),
+    'ship': ('ship', ('name', 'model', 'manufacturer')),
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for kind, (table, columns) in SEARCH_COLUMNS.items():
+        names = ', '.join(columns)
+        if dialect == 'sqlite':
+            op.execute(f"CREATE VIRTUAL TABLE {kind}_search USING fts5({names}, prefix='2 3')")
+            op.execute(f'INSERT INTO {kind}_search (rowid, {names}) SELECT id, {names} FROM {table}')
+        elif dialect == 'postgresql':
+            document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+            op.create_table(f'{kind}_search',
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('name', sa.String(length=250), nullable=True),
+            sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+            )
+            op.create_index(f'ix_{kind}_search_document', f'{kind}_search', ['document'], unique=False, postgresql_using='gin')
+            op.execute(
+                f"INSERT INTO {kind}_search (id, name, document) "
+                f"SELECT id, name, to_tsvector('simple', {document}) FROM {table}"
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return
+    for kind in SEARCH_COLUMNS:
+        op.execute(f'DROP TABLE {kind}_search')
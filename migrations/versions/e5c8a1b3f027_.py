@@ -0,0 +1,73 @@
+"""numeric shadow columns for planet and character stats
+
+Revision ID: e5c8a1b3f027
+Revises: d2b7f0c4e913
+Create Date: 2026-10-18 18:47:12.640285
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c8a1b3f027'
+down_revision = 'd2b7f0c4e913'
+branch_labels = None
+depends_on = None
+
+NUMERIC_COLUMNS = (
+    ('character', ('height',)),
+    ('planet', ('population', 'orbital_period', 'rotation_period', 'diameter')),
+)
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def parse_number(value):
+    # same rules as models.parse_number, copied so the migration does not depend on the app code
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+def backfill(table, columns):
+    # walk the table by primary key in chunks so memory stays bounded on large tables
+    connection = op.get_bind()
+    source = sa.table(table, sa.column('id'), *[sa.column(column) for column in columns])
+    target = sa.table(table, sa.column('id'), *[sa.column(f'{column}_num') for column in columns])
+    update = target.update().where(target.c.id == sa.bindparam('row_id')).values(
+        {f'{column}_num': sa.bindparam(f'{column}_value') for column in columns}
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(source).where(source.c.id > last_id).order_by(source.c.id).limit(BACKFILL_CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [
+            dict({'row_id': row.id}, **{f'{column}_value': parse_number(getattr(row, column)) for column in columns})
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+
+def upgrade():
+    for table, columns in NUMERIC_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.add_column(sa.Column(f'{column}_num', sa.Float(), nullable=True))
+        backfill(table, columns)
+        for column in columns:
+            op.create_index(f'ix_{table}_{column}_num_id', table, [f'{column}_num', 'id'], unique=False)
+
+
+def downgrade():
+    for table, columns in NUMERIC_COLUMNS:
+        for column in columns:
+            op.drop_index(f'ix_{table}_{column}_num_id', table_name=table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.drop_column(f'{column}_num')
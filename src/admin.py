@@ -1,9 +1,11 @@
 import os
-from flask_admin import Admin
 from models import db, User, Character, Planet, Ship, Favorite_Planet, Favorite_Character, Favorite_Ship
-from flask_admin.contrib.sqla import ModelView
 
 def setup_admin(app):
+    # imported here so workers started with ENABLE_ADMIN=0 never load Flask-Admin
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
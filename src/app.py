@@ -2,29 +2,141 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+import click
+from itertools import chain
 from flask import Flask, request, jsonify, url_for
 from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session, selectinload
+from utils import (APIException, generate_sitemap, paginate, paginated_response, stream_response, conditional,
+                   validate_rows, select_fields, serialize_rows, FastJSONProvider,
+                   requested_fields, project, apply_filters, sort_order, requested_ids)
 from admin import setup_admin
-from models import db, User, Character, Planet, Ship, Favorite_Character, Favorite_Planet, Favorite_Ship
+from cache import create_cache
+from instrumentation import setup_instrumentation
+from metrics import setup_metrics
+from database import configure_sqlite, pool_stats, setup_replicas
+import search
+import settings
+from models import (db, User, Character, Planet, Ship, Favorite_Character, Favorite_Planet, Favorite_Ship,
+                    Collection_Version, Popularity, FAVORITE_TYPES, favorite_insert, insert_ignore, parse_number)
 #from models import Person
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+app.json = FastJSONProvider(app)
 
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config.update(settings.from_env())
 
-MIGRATE = Migrate(app, db)
+MIGRATE = Migrate(app, db, include_object=search.include_object)
 db.init_app(app)
+with app.app_context():
+    configure_sqlite(db.engine, app.config)
+setup_replicas(app)
+setup_instrumentation(app)
 CORS(app)
-setup_admin(app)
+if app.config['ENABLE_ADMIN']:
+    setup_admin(app)
+
+# read-through cache for the serialized by-id payloads, use CACHE_BACKEND=sqlite or redis
+# when running several gunicorn workers so they share entries and invalidations
+cache = create_cache(app.config)
+setup_metrics(app, cache)
+
+@event.listens_for(Session, 'after_flush')
+def collect_cache_keys(session, flush_context):
+    # any ORM write to a cached row, including Flask-Admin edits, drops its entry on commit
+    keys = session.info.setdefault('cache_keys', set())
+    for row in chain(session.new, session.dirty, session.deleted):
+        if isinstance(row, (User, Character, Planet, Ship)):
+            keys.add(f'{row.__tablename__}:{row.id}')
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_cache_keys(session):
+    for key in session.info.pop('cache_keys', ()):
+        cache.delete(key)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_cache_keys(session):
+    session.info.pop('cache_keys', None)
+
+def load_serialized(model, id):
+    # cached for every client, so read from the primary rather than a lagging replica
+    with db.session().reading_primary():
+        row = model.query.filter_by(id=id).populate_existing().first()
+    return row.serialize() if row is not None else None
+
+def load_user_with_favorites(user_id, details=True):
+    """User with its favorites (and their entities when `details`) in a fixed number of queries."""
+    options = []
+    for favorites, entity in ((User.favorite_characters, Favorite_Character.character),
+                              (User.favorite_planets, Favorite_Planet.planet),
+                              (User.favorite_ships, Favorite_Ship.ship)):
+        options.append(selectinload(favorites).joinedload(entity) if details else selectinload(favorites))
+    return User.query.options(*options).filter_by(id=user_id).first()
+
+def get_many(model, collection):
+    """Batch lookup for ?ids=1,2,3: cache first, then one IN query for the rest."""
+    ids = requested_ids()
+    keys = {id: f'{collection}:{id}' for id in ids}
+    cached = cache.get_many(list(keys.values()))
+    found = {id: cached[key] for id, key in keys.items() if key in cached}
+
+    missing = [id for id in ids if id not in found]
+    if missing:
+        with db.session().reading_primary():
+            rows = serialize_rows(select_fields(model).filter(model.id.in_(missing)).all())
+        for row in rows:
+            found[row['id']] = row
+            cache.set(keys[row['id']], row)
+
+    fields = requested_fields(model)
+    return jsonify({
+        "results": [project(found[id], fields) for id in ids if id in found],
+        "missing": [id for id in ids if id not in found],
+    }), 200
+
+def bulk_create(model, collection, required):
+    items = request.get_json()
+    if not isinstance(items, list) or not items:
+        raise APIException('the body must be a non empty array', status_code=400)
+    if len(items) > app.config['API_MAX_BULK_SIZE']:
+        raise APIException(f"at most {app.config['API_MAX_BULK_SIZE']} items per request", status_code=400)
+
+    # validate the whole batch before writing anything
+    errors = validate_rows(model, items, required)
+    if errors:
+        raise APIException('invalid items, nothing was created', status_code=400, payload={"errors": errors})
+
+    # one executemany in a single transaction; ids come back only where the
+    # driver supports RETURNING for executemany
+    fields = [field for field in model.serialize_fields if field != 'id']
+    rows = [{field: item.get(field) for field in fields} for item in items]
+    for row in rows:
+        for field, shadow in model.numeric_fields.items():
+            row[shadow] = parse_number(row[field])
+    statement = insert(model.__table__)
+    if db.engine.dialect.insert_executemany_returning:
+        ids = [row.id for row in db.session.execute(statement.returning(model.__table__.c.id), rows)]
+    else:
+        db.session.execute(statement, rows)
+        ids = [None] * len(rows)
+    # without RETURNING (e.g. SQLite on SQLAlchemy 1.4) the new ids are unknown and
+    # the results only map back to the request by index
+    ids_available = None not in ids
+    # exact ids when the driver returned them, otherwise every row missing from the index
+    search.index_new_rows(collection, ids if ids_available else None)
+    Collection_Version.bump(collection)
+    db.session.commit()
+
+    results = []
+    for index, id in enumerate(ids):
+        result = {"index": index, "status": "created"}
+        if ids_available:
+            result["id"] = id
+        results.append(result)
+    return jsonify({"created": len(results), "ids_available": ids_available, "results": results}), 201
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -36,33 +148,103 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    stats = {"cache": cache.stats(), "pool": pool_stats(db.engine)}
+    if 'replicas' in app.extensions:
+        stats["replicas"] = app.extensions['replicas'].stats()
+    return jsonify(stats), 200
+
+@app.route('/search', methods=['GET'])
+def search_names():
+    q = request.args.get('q', '')
+    kinds = request.args.getlist('type') or list(search.SEARCH_COLUMNS)
+    unknown = [kind for kind in kinds if kind not in search.SEARCH_COLUMNS]
+    if unknown:
+        raise APIException(f"unknown type {unknown[0]!r}, expected character, planet or ship", status_code=400)
+    if search.dialect() is None:
+        raise APIException('search is only available on SQLite and Postgres', status_code=501)
+
+    limit = min(request.args.get('limit', 10, type=int), app.config['API_MAX_PAGE_SIZE'])
+    if limit < 1:
+        raise APIException('limit must be a positive integer', status_code=400)
+    return jsonify(search.search(q, kinds, limit)), 200
+
 @app.route('/user', methods=['GET'])
 def get_user():
-    all_user = User.query.all()
-    results = list(map(lambda user: user.serialize(), all_user))
+    if 'ids' in request.args:
+        return get_many(User, 'user')
+
+    if 'stream' in request.args:
+        return stream_response(select_fields(User), User.id)
+
+    users, next_cursor = paginate(select_fields(User), User.id)
+    results = serialize_rows(users)
+
+    return paginated_response(results, next_cursor), 200
 
-    return jsonify(results), 200
+def get_user_document(user_id, include):
+    """?include=favorites adds the user's favorites, ?include=favorites.details also expands
+    the character, planet or ship of every favorite."""
+    unknown = [value for value in include if value not in ('favorites', 'favorites.details')]
+    if unknown:
+        raise APIException(f"can not include {unknown[0]!r}, expected favorites or favorites.details", status_code=400)
+    details = 'favorites.details' in include
+
+    user = load_user_with_favorites(user_id, details=details)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+
+    document = user.serialize()
+    document['favorites'] = {}
+    for type, favorites in (('character', user.favorite_characters),
+                            ('planet', user.favorite_planets),
+                            ('ship', user.favorite_ships)):
+        document['favorites'][type] = []
+        for favorite in favorites:
+            data = favorite.serialize()
+            if details:
+                data[type] = getattr(favorite, type).serialize()
+            document['favorites'][type].append(data)
+    return jsonify(document), 200
 
 @app.route('/user/<int:user_id>', methods=['GET'])
 def get_user_by_id(user_id):
-    user = User.query.filter_by(id=user_id).first()
+    include = [value for value in request.args.get('include', '').split(',') if value]
+    if include:
+        return get_user_document(user_id, include)
+
+    user = cache.get_or_load(f'user:{user_id}', lambda: load_serialized(User, user_id))
+
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
 
-    return jsonify(user.serialize()), 200
+    return jsonify(user), 200
  
 @app.route('/character', methods=['GET'])
+@conditional('character')
 def get_character():
-    all_characters = Character.query.all()
-    characters = list(map(lambda character: character.serialize(),all_characters))
-    return jsonify(characters), 200
+    if 'ids' in request.args:
+        return get_many(Character, 'character')
+
+    sort, descending = sort_order(Character)
+    query = apply_filters(select_fields(Character, requested_fields(Character)), Character)
+    if 'stream' in request.args:
+        return stream_response(query, Character.id, sort, descending)
+
+    all_characters, next_cursor = paginate(query, Character.id, sort, descending)
+    characters = serialize_rows(all_characters)
+    return paginated_response(characters, next_cursor), 200
 
 @app.route('/character/<int:character_id>', methods=['GET'])
 def get_character_by_id(character_id):
-    character = Character.query.filter_by(id=character_id).first()
+    character = cache.get_or_load(f'character:{character_id}', lambda: load_serialized(Character, character_id))
 
     if character is None:
         return jsonify({"error": "Character not found"}), 404
 
-    return jsonify(character.serialize()), 200
+    # the cache keeps the full payload, so projections are served from it as well
+    return jsonify(project(character, requested_fields(Character))), 200
 
 @app.route('/character', methods=['POST'])
 def post_character():
@@ -86,6 +268,8 @@ def post_character():
     
     character = Character(name=body['name'], birth_year=body['birth_year'], gender=body['gender'], height=body['height'], skin_color=body['skin_color'],eye_color=body['eye_color'])
     db.session.add(character)
+    db.session.flush()
+    search.index_row('character', character)
     db.session.commit()
     return jsonify('se creo character exitosamente'), 200
 
@@ -98,28 +282,44 @@ def delete_character_by_id(character_id):
         return jsonify({"error": "Character not found"}), 404
     
     db.session.delete(character)
+    search.remove_row('character', character_id)
+    Popularity.query.filter_by(kind='character', ref_id=character_id).delete()
     db.session.commit()
 
     return jsonify(character.serialize()), 200
 
+@app.route('/character/bulk', methods=['POST'])
+def post_character_bulk():
+    return bulk_create(Character, 'character', ('name', 'birth_year', 'gender', 'height', 'skin_color', 'eye_color'))
+
 
 
 #planet
 
 @app.route('/planet', methods=['GET'])
+@conditional('planet')
 def get_planet():
-    all_planets = Planet.query.all()
-    planets = list(map(lambda character: character.serialize(),all_planets))
-    return jsonify(planets), 200
+    if 'ids' in request.args:
+        return get_many(Planet, 'planet')
+
+    sort, descending = sort_order(Planet)
+    query = apply_filters(select_fields(Planet, requested_fields(Planet)), Planet)
+    if 'stream' in request.args:
+        return stream_response(query, Planet.id, sort, descending)
+
+    all_planets, next_cursor = paginate(query, Planet.id, sort, descending)
+    planets = serialize_rows(all_planets)
+    return paginated_response(planets, next_cursor), 200
 
 @app.route('/planet/<int:planet_id>', methods=['GET'])
 def get_planet_by_id(planet_id):
-    planet = Planet.query.filter_by(id=planet_id).first()
+    planet = cache.get_or_load(f'planet:{planet_id}', lambda: load_serialized(Planet, planet_id))
 
     if planet is None:
         return jsonify({"error": "planet not found"}), 404
 
-    return jsonify(planet.serialize()), 200
+    # the cache keeps the full payload, so projections are served from it as well
+    return jsonify(project(planet, requested_fields(Planet))), 200
 
 @app.route('/planet', methods=['POST'])
 def post_planet():
@@ -143,6 +343,8 @@ def post_planet():
     
     planet = Planet(**body)
     db.session.add(planet)
+    db.session.flush()
+    search.index_row('planet', planet)
     db.session.commit()
     return jsonify('se creo planet exitosamente'), 200
 
@@ -155,26 +357,42 @@ def delete_planet_by_id(planet_id):
         return jsonify({"error": "planet not found"}), 404
     
     db.session.delete(planet)
+    search.remove_row('planet', planet_id)
+    Popularity.query.filter_by(kind='planet', ref_id=planet_id).delete()
     db.session.commit()
 
     return jsonify(planet.serialize()), 200
 
+@app.route('/planet/bulk', methods=['POST'])
+def post_planet_bulk():
+    return bulk_create(Planet, 'planet', ('name', 'climate', 'population', 'orbital_period', 'rotation_period', 'diameter'))
+
 #ship
 
 @app.route('/ship', methods=['GET'])
+@conditional('ship')
 def get_ship():
-    all_ships = Ship.query.all()
-    ships = list(map(lambda ship: ship.serialize(),all_ships))
-    return jsonify(ships), 200
+    if 'ids' in request.args:
+        return get_many(Ship, 'ship')
+
+    sort, descending = sort_order(Ship)
+    query = apply_filters(select_fields(Ship, requested_fields(Ship)), Ship)
+    if 'stream' in request.args:
+        return stream_response(query, Ship.id, sort, descending)
+
+    all_ships, next_cursor = paginate(query, Ship.id, sort, descending)
+    ships = serialize_rows(all_ships)
+    return paginated_response(ships, next_cursor), 200
 
 @app.route('/ship/<int:ship_id>', methods=['GET'])
 def get_ship_by_id(ship_id):
-    ship = Ship.query.filter_by(id=ship_id).first()
+    ship = cache.get_or_load(f'ship:{ship_id}', lambda: load_serialized(Ship, ship_id))
 
     if ship is None:
         return jsonify({"error": "ship not found"}), 404
 
-    return jsonify(ship.serialize()), 200
+    # the cache keeps the full payload, so projections are served from it as well
+    return jsonify(project(ship, requested_fields(Ship))), 200
 
 @app.route('/ship', methods=['POST'])
 def post_ship():
@@ -196,6 +414,8 @@ def post_ship():
     
     ship = Ship(**body)
     db.session.add(ship)
+    db.session.flush()
+    search.index_row('ship', ship)
     db.session.commit()
     return jsonify('se creo ship exitosamente'), 200
 
@@ -208,37 +428,29 @@ def delete_ship_by_id(ship_id):
         return jsonify({"error": "ship not found"}), 404
     
     db.session.delete(ship)
+    search.remove_row('ship', ship_id)
+    Popularity.query.filter_by(kind='ship', ref_id=ship_id).delete()
     db.session.commit()
 
     return jsonify(ship.serialize()), 200
 
+@app.route('/ship/bulk', methods=['POST'])
+def post_ship_bulk():
+    return bulk_create(Ship, 'ship', ('name', 'model', 'manufacturer', 'cost_in_credits', 'crew'))
+
 #favorites user
 
 @app.route('/user/<int:user_id>/favorites', methods=['GET'])
+@conditional('user:{user_id}:favorites')
 def get_user_favorites(user_id):
     
-    user = User.query.filter_by(id=user_id).first()
+    user = load_user_with_favorites(user_id)
     if user is None:
         return jsonify("ERROR: User not found"), 400
 
-    favorite_character = Favorite_Character.query.filter_by(user_id=user_id).all()
-    favorite_planet = Favorite_Planet.query.filter_by(user_id=user_id).all()
-    favorite_ship = Favorite_Ship.query.filter_by(user_id=user_id).all()
-
-    favorite_character_data = []
-    for favorite_character in favorite_character:
-        character = Character.query.filter_by(id=favorite_character.character_id).first()
-        favorite_character_data.append(character.serialize())
-
-    favorite_planet_data = []
-    for favorite_planet in favorite_planet:
-        planet = Planet.query.filter_by(id=favorite_planet.planet_id).first()
-        favorite_planet_data.append(planet.serialize())
-
-    favorite_ship_data = []
-    for favorite_ship in favorite_ship:
-        ship = Ship.query.filter_by(id=favorite_ship.ship_id).first()
-        favorite_ship_data.append(ship.serialize())
+    favorite_character_data = [favorite.character.serialize() for favorite in user.favorite_characters]
+    favorite_planet_data = [favorite.planet.serialize() for favorite in user.favorite_planets]
+    favorite_ship_data = [favorite.ship.serialize() for favorite in user.favorite_ships]
 
     return jsonify({
         "character": favorite_character_data,
@@ -247,34 +459,175 @@ def get_user_favorites(user_id):
     }), 200
 
 
+def add_favorite(type, user_id, entity_id):
+    """Add one favorite with a single INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+
+    Returns (status, favorite) where status is 'created', 'user_not_found',
+    'not_found' or 'exists'. The existence checks only run when nothing was inserted.
+    """
+    favorite_model, model, key = FAVORITE_TYPES[type]
+    dialect = db.session.get_bind().dialect.name
+    returning = dialect == 'postgresql'
+    result = db.session.execute(favorite_insert(type, user_id, entity_id, dialect))
+    favorite_id = result.scalar() if returning else (result.lastrowid if result.rowcount == 1 else None)
+    if favorite_id is None:
+        db.session.rollback()
+        if User.query.get(user_id) is None:
+            return 'user_not_found', None
+        if model.query.get(entity_id) is None:
+            return 'not_found', None
+        return 'exists', None
+
+    Popularity.add(type, [entity_id], 1)
+    Collection_Version.bump(f"user:{user_id}:favorites")
+    db.session.commit()
+    return 'created', favorite_model.query.get(favorite_id)
+
+def group_favorite_items(items, action):
+    if not isinstance(items, list):
+        raise APIException(f'{action} must be an array', status_code=400)
+    grouped = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or item.get('type') not in FAVORITE_TYPES or not isinstance(item.get('id'), int):
+            raise APIException(f'{action}[{index}] must look like {{"type": "character|planet|ship", "id": <int>}}', status_code=400)
+        # dict keeps the request order and drops repeated ids
+        grouped.setdefault(item['type'], {})[item['id']] = None
+    return {type: list(ids) for type, ids in grouped.items()}
+
+def insert_favorites(type, rows):
+    """Insert favorite `rows` with one statement, skipping existing ones, and return the entity ids inserted.
+
+    Without RETURNING the caller must have left out the favorites that exist while
+    holding a lock that keeps other requests from adding them (see batch_user_favorites),
+    so every row is new and the summed rowcount only confirms it.
+    """
+    favorite_model, _, key = FAVORITE_TYPES[type]
+    table = favorite_model.__table__
+    statement = insert_ignore(favorite_model, ['user_id', key])
+    dialect = db.session.get_bind().dialect
+    if dialect.name in ('postgresql', 'sqlite') and dialect.insert_executemany_returning:
+        return [row[0] for row in db.session.execute(statement.returning(table.c[key]), rows)]
+    if db.session.execute(statement, rows).rowcount != len(rows):
+        raise APIException('the favorites changed during the request, nothing was changed', status_code=409)
+    return [row[key] for row in rows]
+
+def delete_favorites(type, user_id, ids):
+    """Delete the user's favorites of `ids` with one statement and return the entity ids actually deleted."""
+    favorite_model, _, key = FAVORITE_TYPES[type]
+    table = favorite_model.__table__
+    if db.session.get_bind().dialect.full_returning:
+        statement = table.delete().where(table.c.user_id == user_id, table.c[key].in_(ids)).returning(table.c[key])
+        return [row[0] for row in db.session.execute(statement)]
+    column = getattr(favorite_model, key)
+    present = [id for id, in db.session.query(column).filter(favorite_model.user_id == user_id, column.in_(ids))
+               .with_for_update()]
+    if present:
+        statement = table.delete().where(table.c.user_id == user_id, table.c[key].in_(present))
+        if db.session.execute(statement).rowcount != len(present):
+            raise APIException('the favorites changed during the request, nothing was changed', status_code=409)
+    return present
+
+@app.route('/user/<int:user_id>/favorites/batch', methods=['POST'])
+def batch_user_favorites(user_id):
+    body = request.get_json()
+    if not isinstance(body, dict):
+        raise APIException('the body must be an object with "add" and/or "remove" arrays', status_code=400)
+    additions = group_favorite_items(body.get('add', []), 'add')
+    removals = group_favorite_items(body.get('remove', []), 'remove')
+
+    user = User.query.get(user_id)
+    if user is None:
+        return jsonify("ERROR: User not found"), 400
+
+    # resolve every referenced entity with one IN query per type before writing
+    names = {}
+    missing = {}
+    for type, ids in additions.items():
+        model = FAVORITE_TYPES[type][1]
+        names[type] = dict(db.session.query(model.id, model.name).filter(model.id.in_(ids)))
+        not_found = [id for id in ids if id not in names[type]]
+        if not_found:
+            missing[type] = not_found
+    if missing:
+        raise APIException('some ids do not exist, nothing was changed', status_code=400, payload={"missing": missing})
+
+    # the first write: on SQLite it takes the database write lock, so no other request
+    # can add or remove favorites between the reads below and the inserts/deletes
+    Collection_Version.bump(f"user:{user_id}:favorites")
+
+    added, skipped, removed = {}, {}, {}
+    for type, ids in additions.items():
+        favorite_model, _, key = FAVORITE_TYPES[type]
+        column = getattr(favorite_model, key)
+        # FOR UPDATE locks the (user, id) index range on MySQL, SQLite ignores it
+        existing = {id for id, in db.session.query(column).filter(favorite_model.user_id == user_id, column.in_(ids))
+                    .with_for_update()}
+        new_ids = [id for id in ids if id not in existing]
+        inserted = set()
+        if new_ids:
+            inserted = set(insert_favorites(type, [
+                {"user_id": user_id, key: id, "description": f"{user.email} likes {names[type][id]}"}
+                for id in new_ids
+            ]))
+        added[type] = [id for id in new_ids if id in inserted]
+        skipped[type] = [id for id in ids if id not in inserted]
+        Popularity.add(type, added[type], 1)
+
+    for type, ids in removals.items():
+        deleted = set(delete_favorites(type, user_id, ids))
+        removed[type] = [id for id in ids if id in deleted]
+        Popularity.add(type, removed[type], -1)
+
+    db.session.commit()
+
+    return jsonify({"added": added, "skipped": skipped, "removed": removed}), 200
+
+@app.route('/popular/<type>', methods=['GET'])
+def get_popular(type):
+    if type not in FAVORITE_TYPES:
+        return jsonify({"error": "type must be character, planet or ship"}), 404
+    model = FAVORITE_TYPES[type][1]
+    limit = min(request.args.get('limit', 10, type=int), app.config['API_MAX_PAGE_SIZE'])
+    if limit < 1:
+        raise APIException('limit must be a positive integer', status_code=400)
+
+    # top-N straight off the (kind, favorites, ref_id) index
+    top = db.session.query(Popularity.ref_id, Popularity.favorites, model.name) \
+        .join(model, model.id == Popularity.ref_id) \
+        .filter(Popularity.kind == type, Popularity.favorites > 0) \
+        .order_by(Popularity.favorites.desc(), Popularity.ref_id.desc()) \
+        .limit(limit)
+    return jsonify([{"id": ref_id, "name": name, "favorites": favorites} for ref_id, favorites, name in top]), 200
+
+@app.cli.command('reconcile-popularity')
+def reconcile_popularity():
+    """Rebuild the popularity counters from the favorite tables."""
+    Popularity.query.delete()
+    for type, (favorite_model, _, key) in FAVORITE_TYPES.items():
+        column = getattr(favorite_model, key)
+        counts = db.session.query(column, db.func.count()).group_by(column).all()
+        if counts:
+            db.session.execute(insert(Popularity.__table__), [
+                {"kind": type, "ref_id": ref_id, "favorites": favorites} for ref_id, favorites in counts
+            ])
+    db.session.commit()
+    click.echo('popularity counters rebuilt')
+
 #favorite planet
 
 
 @app.route('/favorites/planet', methods=['POST'])
 def add_favorite_planet():
     request_body = request.get_json()
-       
-    user = User.query.get(request_body["user_id"])
-    if user is None:
-        return jsonify("no existe el id de usuario"), 400
 
-    planet = Planet.query.get(request_body["planet_id"])
-    if planet is None:
+    status, new_favorite = add_favorite('planet', request_body["user_id"], request_body["planet_id"])
+    if status == 'user_not_found':
+        return jsonify("no existe el id de usuario"), 400
+    if status == 'not_found':
         return jsonify("no existe ese id de planeta"), 400
-    
-    existing_favorite = Favorite_Planet.query.filter_by(user_id=request_body["user_id"], planet_id=request_body["planet_id"]).first()
-    if existing_favorite:
+    if status == 'exists':
         return jsonify("planeta favorito ya existe"), 400
 
-    new_favorite = Favorite_Planet(
-        user_id=request_body["user_id"],
-        planet_id=request_body["planet_id"],
-        description=f"{user.email} likes {planet.name}"
-    )
-
-    db.session.add(new_favorite)
-    db.session.commit()
-
     return jsonify(new_favorite.serialize()), 200
 
 @app.route('/favorites/planet/<int:favorite_planet_id>', methods=['DELETE'])
@@ -286,6 +639,7 @@ def delete_favorite_planet(favorite_planet_id):
         return jsonify("ERROR: Favorite planet not found"), 400
 
     db.session.delete(favorite_planet)
+    Popularity.add('planet', [favorite_planet.planet_id], -1)
     db.session.commit()
 
     return jsonify(favorite_planet.serialize()), 200
@@ -295,28 +649,15 @@ def delete_favorite_planet(favorite_planet_id):
 @app.route('/favorites/character', methods=['POST'])
 def add_favorite_character():
     request_body = request.get_json()
-             
-    user = User.query.get(request_body["user_id"])
-    if user is None:
-        return jsonify("no existe el id de usuario"), 400
 
-    character = Character.query.get(request_body["character_id"])
-    if character is None:
+    status, new_favorite = add_favorite('character', request_body["user_id"], request_body["character_id"])
+    if status == 'user_not_found':
+        return jsonify("no existe el id de usuario"), 400
+    if status == 'not_found':
         return jsonify("no existe ese id de personaje"), 400
-    
-    existing_favorite = Favorite_Character.query.filter_by(user_id=request_body["user_id"], character_id=request_body["character_id"]).first()
-    if existing_favorite:
+    if status == 'exists':
         return jsonify("personaje favorito ya existe"), 400
 
-    new_favorite = Favorite_Character(
-        user_id=request_body["user_id"],
-        character_id=request_body["character_id"],
-        description=f"{user.email} likes {character.name}"
-    )
-
-    db.session.add(new_favorite)
-    db.session.commit()
-
     return jsonify(new_favorite.serialize()), 200
 
 @app.route('/favorites/character/<int:favorite_character_id>', methods=['DELETE'])
@@ -327,6 +668,7 @@ def delete_favorite_character(favorite_character_id):
         return jsonify("no se encontro el favorito"), 400
 
     db.session.delete(favorite_character)
+    Popularity.add('character', [favorite_character.character_id], -1)
     db.session.commit()
 
     return jsonify(favorite_character.serialize()), 200
@@ -336,28 +678,15 @@ def delete_favorite_character(favorite_character_id):
 @app.route('/favorites/ship', methods=['POST'])
 def add_favorite_ship():
     request_body = request.get_json()
-             
-    user = User.query.get(request_body["user_id"])
-    if user is None:
-        return jsonify("ERROR: user_id not exist"), 400
 
-    ship = Ship.query.get(request_body["ship_id"])
-    if ship is None:
+    status, new_favorite = add_favorite('ship', request_body["user_id"], request_body["ship_id"])
+    if status == 'user_not_found':
+        return jsonify("ERROR: user_id not exist"), 400
+    if status == 'not_found':
         return jsonify("ERROR: ship_id not exist"), 400
-    
-    existing_favorite = Favorite_Ship.query.filter_by(user_id=request_body["user_id"], ship_id=request_body["ship_id"]).first()
-    if existing_favorite:
+    if status == 'exists':
         return jsonify("ERROR: favorite ship already exists for this user"), 400
 
-    new_favorite = Favorite_Ship(
-        user_id=request_body["user_id"],
-        ship_id=request_body["ship_id"],
-        description=f"{user.email} likes {ship.name}"
-    )
-
-    db.session.add(new_favorite)
-    db.session.commit()
-
     return jsonify(new_favorite.serialize()), 200
 
 @app.route('/favorites/ship/<int:favorite_ship_id>', methods=['DELETE'])
@@ -368,6 +697,7 @@ def delete_favorite_ship(favorite_ship_id):
         return jsonify("no se encontro el favorito"), 400
 
     db.session.delete(favorite_ship)
+    Popularity.add('ship', [favorite_ship.ship_id], -1)
     db.session.commit()
 
     return jsonify(favorite_ship.serialize()), 200
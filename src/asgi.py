@@ -0,0 +1,207 @@
+"""
+Asyncio entry point, an alternative to wsgi.py for I/O bound deployments:
+
+    pipenv install --categories "packages asgi"
+    uvicorn asgi:app --app-dir src --workers 4
+
+It serves the resource reads and the favorites routes with async handlers on an
+async engine (asyncpg, aiosqlite or aiomysql) built from the same settings and
+models, without importing the Flask app. The lists take the same ?limit=, ?after=,
+filters, ?sort= and ?fields= as the Flask app; ?ids= and ?stream= are answered
+with 400. There is no by-id cache and writes other than favorites stay on the WSGI app.
+"""
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import selectinload, sessionmaker
+import settings
+from database import async_url, configure_sqlite
+from models import User, Character, Planet, Ship, Collection_Version, Popularity, FAVORITE_TYPES, favorite_insert
+from utils import (APIException, orjson, requested_fields, apply_filters, sort_order, order_clauses,
+                   keyset_filter, encode_cursor, decode_cursor, serialize_rows)
+
+config = settings.from_env()
+# the pool settings apply, the pool class is the asyncio one picked by SQLAlchemy
+engine_options = {key: value for key, value in config['SQLALCHEMY_ENGINE_OPTIONS'].items() if key != 'poolclass'}
+engine = create_async_engine(async_url(config['SQLALCHEMY_DATABASE_URI']), **engine_options)
+configure_sqlite(engine.sync_engine, config)
+Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+RESOURCES = {
+    'user': (User, "User not found"),
+    'character': (Character, "Character not found"),
+    'planet': (Planet, "planet not found"),
+    'ship': (Ship, "ship not found"),
+}
+# list params of the Flask app that need its synchronous session
+UNSUPPORTED_LIST_PARAMS = ('ids', 'stream')
+
+# type -> messages of the WSGI routes for a missing user, a missing entity, a repeated
+# favorite and an unknown favorite id
+FAVORITE_ERRORS = {
+    'character': ("no existe el id de usuario", "no existe ese id de personaje",
+                  "personaje favorito ya existe", "no se encontro el favorito"),
+    'planet': ("no existe el id de usuario", "no existe ese id de planeta",
+               "planeta favorito ya existe", "ERROR: Favorite planet not found"),
+    'ship': ("ERROR: user_id not exist", "ERROR: ship_id not exist",
+             "ERROR: favorite ship already exists for this user", "no se encontro el favorito"),
+}
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+def query_int(request, name, default=None):
+    # like request.args.get(name, default, type=int) in Flask
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+async def bump_version(session, name):
+    # same as Collection_Version.bump, in the caller's transaction
+    result = await session.execute(update(Collection_Version).where(Collection_Version.name == name)
+                                   .values(version=Collection_Version.version + 1))
+    if not result.rowcount:
+        session.add(Collection_Version(name=name, version=1))
+
+async def add_popularity(session, kind, ref_id, delta):
+    statement, rows = Popularity.add_statement(kind, [ref_id], delta, session.bind.dialect.name)
+    await session.execute(statement, rows)
+
+async def list_resource(request):
+    collection = request.url.path.strip('/')
+    model = RESOURCES[collection][0]
+    args = request.query_params
+    for name in UNSUPPORTED_LIST_PARAMS:
+        if name in args:
+            raise APIException(f'{name} is not supported by the ASGI server', status_code=400)
+    max_page_size = config['API_MAX_PAGE_SIZE']
+    limit = query_int(request, 'limit', max_page_size)
+    if limit < 1:
+        raise APIException('limit must be a positive integer', status_code=400)
+    limit = min(limit, max_page_size)
+
+    # same query as paginate() in utils, users are listed by id only like on the Flask app
+    key = model.id
+    if hasattr(model, 'filter_fields'):
+        sort, descending = sort_order(model, args)
+        statement = apply_filters(select(*[getattr(model, field) for field in requested_fields(model, args)]), model, args)
+    else:
+        sort, descending = key, False
+        statement = select(*[getattr(model, field) for field in model.serialize_fields])
+    by_key = sort is key
+    after = args.get('after')
+    if after is not None and by_key:
+        try:
+            after = int(after)
+        except ValueError:
+            raise APIException('after must be an integer id', status_code=400)
+        statement = statement.where(key < after if descending else key > after)
+    elif after is not None:
+        statement = statement.where(keyset_filter(key, sort, descending, *decode_cursor(after), dialect=engine.dialect.name))
+    if not by_key:
+        statement = statement.add_columns(sort.label('_sort'))
+    statement = statement.order_by(*order_clauses(key, sort, descending)).limit(limit + 1)
+    async with Session() as session:
+        rows = (await session.execute(statement)).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_url = request.url.include_query_params(after=last.id if by_key else encode_cursor(last._sort, last.id))
+        headers['Link'] = f'<{next_url.path}?{next_url.query}>; rel="next"'
+    return FastJSONResponse(serialize_rows(rows), headers=headers)
+
+async def get_resource(request):
+    model, not_found = RESOURCES[request.url.path.split('/')[1]]
+    async with Session() as session:
+        row = await session.get(model, request.path_params['id'])
+    if row is None:
+        return FastJSONResponse({"error": not_found}, status_code=404)
+    return FastJSONResponse(row.serialize())
+
+async def get_user_favorites(request):
+    statement = select(User).where(User.id == request.path_params['user_id']).options(
+        selectinload(User.favorite_characters).joinedload(FAVORITE_TYPES['character'][0].character),
+        selectinload(User.favorite_planets).joinedload(FAVORITE_TYPES['planet'][0].planet),
+        selectinload(User.favorite_ships).joinedload(FAVORITE_TYPES['ship'][0].ship),
+    )
+    async with Session() as session:
+        user = (await session.execute(statement)).scalar()
+    if user is None:
+        return FastJSONResponse("ERROR: User not found", status_code=400)
+    return FastJSONResponse({
+        "character": [favorite.character.serialize() for favorite in user.favorite_characters],
+        "planet": [favorite.planet.serialize() for favorite in user.favorite_planets],
+        "ship": [favorite.ship.serialize() for favorite in user.favorite_ships],
+    })
+
+async def add_favorite(request):
+    type = request.url.path.split('/')[2]
+    favorite_model, model, key = FAVORITE_TYPES[type]
+    body = await request.json()
+    user_id, entity_id = body["user_id"], body[key]
+
+    async with Session() as session:
+        dialect = session.bind.dialect.name
+        result = await session.execute(favorite_insert(type, user_id, entity_id, dialect))
+        favorite_id = result.scalar() if dialect == 'postgresql' else (result.lastrowid if result.rowcount == 1 else None)
+        if favorite_id is None:
+            await session.rollback()
+            user_error, not_found, exists, _ = FAVORITE_ERRORS[type]
+            if await session.get(User, user_id) is None:
+                return FastJSONResponse(user_error, status_code=400)
+            if await session.get(model, entity_id) is None:
+                return FastJSONResponse(not_found, status_code=400)
+            return FastJSONResponse(exists, status_code=400)
+
+        await add_popularity(session, type, entity_id, 1)
+        await bump_version(session, f"user:{user_id}:favorites")
+        await session.commit()
+        favorite = await session.get(favorite_model, favorite_id)
+        return FastJSONResponse(favorite.serialize())
+
+async def delete_favorite(request):
+    type = request.url.path.split('/')[2]
+    favorite_model, _, key = FAVORITE_TYPES[type]
+
+    async with Session() as session:
+        favorite = await session.get(favorite_model, request.path_params['id'])
+        if favorite is None:
+            return FastJSONResponse(FAVORITE_ERRORS[type][3], status_code=400)
+
+        await session.delete(favorite)
+        # the flush listener in models.py bumps the user's favorites version
+        await add_popularity(session, type, getattr(favorite, key), -1)
+        await session.commit()
+        return FastJSONResponse(favorite.serialize())
+
+async def handle_invalid_usage(request, error):
+    return FastJSONResponse(error.to_dict(), status_code=error.status_code)
+
+routes = []
+for collection in RESOURCES:
+    routes += [
+        Route(f'/{collection}', list_resource, methods=['GET']),
+        Route(f'/{collection}/{{id:int}}', get_resource, methods=['GET']),
+    ]
+routes.append(Route('/user/{user_id:int}/favorites', get_user_favorites, methods=['GET']))
+for type in FAVORITE_TYPES:
+    routes += [
+        Route(f'/favorites/{type}', add_favorite, methods=['POST']),
+        Route(f'/favorites/{type}/{{id:int}}', delete_favorite, methods=['DELETE']),
+    ]
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+app = Starlette(routes=routes, exception_handlers={APIException: handle_invalid_usage}, lifespan=lifespan)
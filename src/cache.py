@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+class Cache:
+    """Interface shared by the cache backends.
+
+    Values are the serialized payloads of single rows, keyed by strings like
+    'character:1'. A `None` value is never stored, so it can be used as the miss marker.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Dict of the cached values among `keys`, misses are left out."""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value)
+        return value
+
+class SharedCounters:
+    """Hit/miss style counters summed over every process using a shared cache.
+
+    Each process keeps its own running totals in attributes (read by /metrics) and
+    adds what it counted since the last flush to the shared store at most every
+    `FLUSH_INTERVAL` seconds, so reads don't turn into writes.
+    """
+
+    FLUSH_INTERVAL = 1.0
+    COUNTERS = ('hits', 'misses', 'evictions', 'expirations')
+
+    def _init_counters(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self._pending = dict.fromkeys(self.COUNTERS, 0)
+        self._pending_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def _count(self, name, amount=1):
+        if amount <= 0:
+            return
+        with self._pending_lock:
+            setattr(self, name, getattr(self, name) + amount)
+            self._pending[name] += amount
+            due = time.monotonic() - self._flushed_at >= self.FLUSH_INTERVAL
+        if due:
+            self.flush_counters()
+
+    def flush_counters(self):
+        with self._pending_lock:
+            pending = {name: value for name, value in self._pending.items() if value}
+            self._pending = dict.fromkeys(self.COUNTERS, 0)
+            self._flushed_at = time.monotonic()
+        if pending:
+            self._add_shared_counters(pending)
+
+    def shared_counters(self):
+        self.flush_counters()
+        totals = dict.fromkeys(self.COUNTERS, 0)
+        totals.update(self._load_shared_counters())
+        return totals
+
+class LRUCache(Cache):
+    """Bounded in-process cache with least-recently-used and time-to-live eviction.
+
+    Every process keeps its own copy, so only use it with a single worker.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if value is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+class SQLiteCache(SharedCounters, Cache):
+    """Cache stored in a SQLite file shared by every worker process on the host.
+
+    Deletes are visible to all workers as soon as they are committed, so an
+    invalidation in one worker is seen by the others on their next read.
+    """
+
+    # how stale the LRU timestamp of an entry may get before a read refreshes it
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, path, max_entries=1024, ttl=300, clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        self._init_counters()
+
+    def _connection(self):
+        # sqlite connections must not be shared across fork() or threads
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entry ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_accessed_at ON cache_entry (accessed_at)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_counter (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT value, expires_at, accessed_at FROM cache_entry WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        value, expires_at, accessed_at = row
+        now = self.clock()
+        if expires_at <= now:
+            connection.execute('DELETE FROM cache_entry WHERE key = ? AND expires_at <= ?', (key, now))
+            self._count('expirations')
+            self._count('misses')
+            return None
+        if now - accessed_at > self.TOUCH_INTERVAL:
+            connection.execute('UPDATE cache_entry SET accessed_at = ? WHERE key = ?', (now, key))
+        self._count('hits')
+        return json.loads(value)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        now = self.clock()
+        placeholders = ', '.join('?' * len(keys))
+        rows = self._connection().execute(
+            f'SELECT key, value FROM cache_entry WHERE key IN ({placeholders}) AND expires_at > ?', (*keys, now)
+        ).fetchall()
+        self._count('hits', len(rows))
+        self._count('misses', len(keys) - len(rows))
+        return {key: json.loads(value) for key, value in rows}
+
+    def set(self, key, value):
+        if value is None or self.max_entries <= 0:
+            return
+        connection = self._connection()
+        now = self.clock()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), now + self.ttl, now),
+        )
+        evicted = connection.execute(
+            'DELETE FROM cache_entry WHERE key IN ('
+            'SELECT key FROM cache_entry ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        ).rowcount
+        self._count('evictions', evicted)
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entry')
+
+    def _add_shared_counters(self, counts):
+        self._connection().executemany(
+            'INSERT INTO cache_counter (name, value) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value',
+            counts.items(),
+        )
+
+    def _load_shared_counters(self):
+        return dict(self._connection().execute('SELECT name, value FROM cache_counter').fetchall())
+
+    def stats(self):
+        size = self._connection().execute('SELECT count(*) FROM cache_entry').fetchone()[0]
+        # totals of every worker sharing the file
+        return {
+            "backend": "sqlite",
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            **self.shared_counters(),
+        }
+
+class RedisCache(SharedCounters, Cache):
+    """Cache stored in Redis, shared by every worker on every host.
+
+    Requires the optional `redis` package. Entries expire through Redis TTLs and
+    size is bounded by the server's maxmemory policy.
+    """
+
+    def __init__(self, url, ttl=300, prefix='api-cache:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._init_counters()
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(value)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        values = {key: json.loads(value) for key, value in zip(keys, self.client.mget([self.prefix + key for key in keys])) if value is not None}
+        self._count('hits', len(values))
+        self._count('misses', len(keys) - len(values))
+        return values
+
+    def set(self, key, value):
+        if value is None:
+            return
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = [key for key in self.client.scan_iter(self.prefix + '*') if key != (self.prefix + 'counters').encode()]
+        if keys:
+            self.client.delete(*keys)
+
+    def _add_shared_counters(self, counts):
+        pipeline = self.client.pipeline()
+        for name, value in counts.items():
+            pipeline.hincrby(self.prefix + 'counters', name, value)
+        pipeline.execute()
+
+    def _load_shared_counters(self):
+        return {name.decode(): int(value) for name, value in self.client.hgetall(self.prefix + 'counters').items()}
+
+    def stats(self):
+        # totals of every worker on every host
+        counters = self.shared_counters()
+        return {
+            "backend": "redis",
+            "ttl": self.ttl,
+            "hits": counters['hits'],
+            "misses": counters['misses'],
+        }
+
+def create_cache(config):
+    backend = config['CACHE_BACKEND']
+    if backend == 'memory':
+        return LRUCache(config['CACHE_MAX_ENTRIES'], config['CACHE_TTL'])
+    if backend == 'sqlite':
+        # one file per database, so apps on the same host never share entries
+        database = hashlib.md5(config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:8]
+        path = config['CACHE_URL'] or os.path.join(tempfile.gettempdir(), f'api-cache-{database}.sqlite3')
+        return SQLiteCache(path, config['CACHE_MAX_ENTRIES'], config['CACHE_TTL'])
+    if backend == 'redis':
+        return RedisCache(config['CACHE_URL'] or 'redis://localhost:6379/0', config['CACHE_TTL'])
+    raise ValueError(f'Unknown CACHE_BACKEND {backend!r}, expected memory, sqlite or redis')
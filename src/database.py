@@ -0,0 +1,266 @@
+"""
+Engine tuning that depends on the database behind SQLALCHEMY_DATABASE_URI.
+"""
+import math
+import time
+import threading
+from contextlib import contextmanager
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+def sqlite_pragmas(config, in_memory=False):
+    pragmas = [
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT']),
+        ('foreign_keys', 'ON' if config['SQLITE_FOREIGN_KEYS'] else 'OFF'),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+    ]
+    if not in_memory:
+        # WAL lets readers run while a writer commits, NORMAL only fsyncs at checkpoints
+        pragmas += [
+            ('journal_mode', 'WAL'),
+            ('synchronous', 'NORMAL'),
+            ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ]
+    return pragmas
+
+def configure_sqlite(engine, config):
+    """Apply the SQLite profile to every new connection of `engine`, no-op for other databases."""
+    if engine.dialect.name != 'sqlite' or not config['SQLITE_TUNING']:
+        return
+    pragmas = sqlite_pragmas(config, in_memory=engine.url.database in (None, '', ':memory:'))
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+# asyncio drivers used by the ASGI entry point
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+}
+
+def async_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'no asyncio driver for {backend!r}, expected postgresql, sqlite or mysql')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.checkout_seconds += elapsed
+                self.max_checkout_seconds = max(self.max_checkout_seconds, elapsed)
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database, pool settings are per process."""
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "timeouts": pool.timeouts,
+                "checkout_ms_avg": round(1000 * pool.checkout_seconds / pool.checkouts, 3) if pool.checkouts else 0.0,
+                "checkout_ms_max": round(1000 * pool.max_checkout_seconds, 3),
+            })
+    return stats
+
+def check_connect_args(url, timeout):
+    """Driver arguments bounding how long connecting and running a query may take, in seconds."""
+    backend = url.get_backend_name()
+    if backend == 'postgresql':
+        return {'connect_timeout': max(math.ceil(timeout), 1), 'options': f'-c statement_timeout={int(timeout * 1000)}'}
+    if backend == 'mysql':
+        return {'connect_timeout': max(math.ceil(timeout), 1), 'read_timeout': max(math.ceil(timeout), 1)}
+    if backend == 'sqlite':
+        return {'timeout': timeout}
+    return {}
+
+# requests with these methods may read from a replica
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# set after a client's write, holds the time until which its reads stay on the primary
+STICKY_COOKIE = 'db_primary_until'
+
+class ReplicaSet:
+    """Round-robin over the replica engines, skipping the ones that fail a health check.
+
+    The check runs in the request that finds the previous one stale, on its own
+    unpooled connection with `check_timeout`, so an unreachable replica delays that
+    request by at most the timeout instead of the driver's default (minutes for TCP).
+    """
+
+    def __init__(self, engines, check_interval=10, check_timeout=2, clock=time.monotonic):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.clock = clock
+        self._check_engines = {engine: create_engine(engine.url, poolclass=NullPool,
+                                                     connect_args=check_connect_args(engine.url, check_timeout))
+                               for engine in engines}
+        self._lock = threading.Lock()
+        self._next = 0
+        # engine -> (healthy, checked_at)
+        self._health = {}
+        for engine in engines:
+            event.listen(engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect and context.engine is not None:
+            self._health[context.engine] = (False, self.clock())
+
+    def check(self, engine):
+        try:
+            with self._check_engines[engine].connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+            return True
+        except exc.DBAPIError:
+            return False
+
+    def healthy(self, engine):
+        now = self.clock()
+        state = self._health.get(engine)
+        if state is None or now - state[1] >= self.check_interval:
+            state = (self.check(engine), now)
+            self._health[engine] = state
+        return state[0]
+
+    def pick(self):
+        """Next healthy replica, or None when they are all down."""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.engines)
+        for offset in range(len(self.engines)):
+            engine = self.engines[(start + offset) % len(self.engines)]
+            if self.healthy(engine):
+                return engine
+        return None
+
+    def stats(self):
+        return [{"url": engine.url.render_as_string(hide_password=True), "healthy": self._health.get(engine, (None,))[0]}
+                for engine in self.engines]
+
+def reads_from_replica():
+    if not has_request_context() or 'replicas' not in current_app.extensions:
+        return False
+    if request.method not in READ_METHODS:
+        return False
+    primary_until = request.cookies.get(STICKY_COOKIE, type=float)
+    return primary_until is None or primary_until <= time.time()
+
+class RoutingSession(Session):
+    """Sends the reads of read-only requests to a replica and everything else to the primary.
+
+    The replica is picked once per session so a request sees a single snapshot, and
+    a session that has written keeps reading from the primary.
+    """
+
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        self._replica = None
+        self._wrote = False
+        self._primary_reads = 0
+
+    @contextmanager
+    def reading_primary(self):
+        """Send the reads inside the block to the primary.
+
+        For results that outlive the request, like the shared by-id cache: a lagging
+        replica would otherwise put back rows that a write has just invalidated.
+        """
+        self._primary_reads += 1
+        try:
+            yield
+        finally:
+            self._primary_reads -= 1
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or primary is not self._db.engines.get(None):
+            return primary
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self._wrote = True
+        if self._wrote or self._primary_reads or not reads_from_replica():
+            return primary
+        if self._replica is None:
+            self._replica = current_app.extensions['replicas'].pick() or primary
+        return self._replica
+
+def setup_replicas(app):
+    """Create the DATABASE_REPLICA_URLS engines and the read-your-writes cookie."""
+    urls = app.config['DATABASE_REPLICA_URLS']
+    if not urls:
+        return
+    engines = []
+    for url in urls:
+        engine = create_engine(url, **app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        configure_sqlite(engine, app.config)
+        engines.append(engine)
+    app.extensions['replicas'] = ReplicaSet(engines, app.config['DATABASE_REPLICA_CHECK_INTERVAL'],
+                                            app.config['DATABASE_REPLICA_CHECK_TIMEOUT'])
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            window = app.config['DATABASE_REPLICA_STICKY_SECONDS']
+            response.set_cookie(STICKY_COOKIE, str(time.time() + window), max_age=window, httponly=True)
+        return response
+
+def dispose_engines(app, db):
+    """Drop the pooled connections inherited from the parent process, call right after fork().
+
+    close=False leaves the parent's connections open for the parent while the child
+    starts with empty pools.
+    """
+    with app.app_context():
+        engines = list(db.engines.values())
+    engines += app.extensions['replicas'].engines if 'replicas' in app.extensions else []
+    for engine in engines:
+        engine.dispose(close=False)
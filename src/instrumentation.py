@@ -0,0 +1,61 @@
+"""
+Opt-in per-request SQL instrumentation.
+
+Every statement run while handling a request is counted and timed in `g` when either
+SQL_INSTRUMENTATION=1 or the /metrics endpoint is enabled. With SQL_INSTRUMENTATION=1
+the totals also go out in a Server-Timing header and statements repeated at least
+SQL_N_PLUS_ONE_THRESHOLD times in one request are logged as a possible N+1. Streamed
+bodies run their queries after the headers are sent, so only the queries before the
+first chunk are counted.
+"""
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# the start time lives on the execution context, which is dropped with the statement
+# whether it succeeds or raises, so a failed query leaves nothing behind
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and context is not None:
+        context._query_started = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None or not has_request_context() or 'sql_statements' not in g:
+        return
+    g.sql_time += time.perf_counter() - started
+    # the parameters are bound separately, so the text is the statement's shape
+    g.sql_statements[statement] += 1
+
+def setup_instrumentation(app):
+    if not app.config['SQL_INSTRUMENTATION'] and not app.config['METRICS_ENABLED']:
+        return
+    # on the Engine class so the replica engines are covered as well
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_sql_timing():
+        g.request_started = time.perf_counter()
+        g.sql_time = 0.0
+        g.sql_statements = Counter()
+
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    @app.after_request
+    def add_server_timing(response):
+        if 'sql_statements' not in g:
+            return response
+        count = sum(g.sql_statements.values())
+        timing = (f'db;desc="{count} queries";dur={g.sql_time * 1000:.2f}, '
+                  f'app;dur={(time.perf_counter() - g.request_started) * 1000:.2f}')
+        existing = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        for statement, repeats in g.sql_statements.items():
+            if repeats >= app.config['SQL_N_PLUS_ONE_THRESHOLD']:
+                app.logger.warning('possible N+1 on %s %s: %d x %s', request.method, route, repeats, ' '.join(statement.split()))
+        return response
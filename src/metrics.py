@@ -0,0 +1,76 @@
+"""
+Prometheus metrics at /metrics, requires the optional `prometheus_client` package.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR (set up by
+gunicorn.conf.py) and /metrics merges the files, so any worker answers for all of them.
+Without that variable the metrics are those of the current process.
+"""
+import os
+import time
+from flask import Response, g, request
+
+def setup_metrics(app, cache):
+    if not app.config['METRICS_ENABLED']:
+        return
+    try:
+        from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                                       REGISTRY, generate_latest, multiprocess)
+    except ImportError:
+        app.logger.warning('METRICS_ENABLED is set but prometheus_client is not installed, /metrics is disabled')
+        return
+
+    requests_total = Counter('http_requests_total', 'Requests handled', ['method', 'endpoint', 'status'])
+    request_seconds = Histogram('http_request_duration_seconds', 'Time spent in the handler', ['method', 'endpoint'])
+    db_seconds = Histogram('http_request_db_seconds', 'Time spent in SQL statements per request', ['endpoint'])
+    db_statements = Counter('http_request_db_statements_total', 'SQL statements run by requests', ['endpoint'])
+    in_flight = Gauge('http_requests_in_progress', 'Requests being handled', multiprocess_mode='livesum')
+    cache_requests = Counter('cache_requests_total', 'By-id cache lookups', ['result'])
+    cache_results = {'hits': cache_requests.labels('hit'), 'misses': cache_requests.labels('miss')}
+    # the cache counters are per process and cumulative, only their growth is exported
+    cache_seen = {'hits': 0, 'misses': 0}
+    # (method, endpoint, status) -> labelled metrics, .labels() is the slow part of a sample
+    children = {}
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        in_flight.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        state = g._get_current_object()
+        if 'metrics_started' not in state:
+            return response
+        elapsed = time.perf_counter() - state.metrics_started
+        current_request = request._get_current_object()
+        endpoint = current_request.url_rule.rule if current_request.url_rule is not None else 'unmatched'
+        key = (current_request.method, endpoint, response.status_code)
+        if key not in children:
+            children[key] = (requests_total.labels(*key), request_seconds.labels(*key[:2]),
+                             db_seconds.labels(endpoint), db_statements.labels(endpoint))
+        total, seconds, sql_seconds, sql_statements = children[key]
+        total.inc()
+        seconds.observe(elapsed)
+        if 'sql_statements' in state:
+            sql_seconds.observe(state.sql_time)
+            sql_statements.inc(sum(state.sql_statements.values()))
+        for attribute, counter in cache_results.items():
+            current = getattr(cache, attribute)
+            if current > cache_seen[attribute]:
+                counter.inc(current - cache_seen[attribute])
+                cache_seen[attribute] = current
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(error=None):
+        if 'metrics_started' in g:
+            in_flight.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
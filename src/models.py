@@ -1,6 +1,43 @@
 from flask_sqlalchemy import SQLAlchemy
+from itertools import chain
+from sqlalchemy import event, insert, inspect, select, true
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session, validates
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def favorite_description(favorite, entity):
+    # Only use relationships that are already loaded so serializing never
+    # issues extra queries; otherwise fall back to the stored description.
+    unloaded = inspect(favorite).unloaded
+    if 'user' in unloaded or entity in unloaded:
+        return favorite.description
+    user = favorite.user
+    target = getattr(favorite, entity)
+    if user is None or target is None:
+        return favorite.description
+    return f"{user.email} likes {target.name}"
+
+def parse_number(value):
+    """Numeric value of stats like '1,000,000' or '172', None for 'unknown' and friends."""
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return None
+
+def insert_ignore(model, index_elements, dialect=None):
+    """INSERT for `model` that silently skips rows conflicting on the unique `index_elements`."""
+    dialect = dialect or db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model.__table__).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == 'sqlite':
+        return sqlite.insert(model.__table__).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == 'mysql':
+        return insert(model.__table__).prefix_with('IGNORE')
+    raise NotImplementedError(f'insert_ignore is not supported for {dialect}')
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,17 +48,25 @@ class User(db.Model):
     favorite_characters = db.relationship('Favorite_Character', backref='user', lazy=True)
     favorite_ships = db.relationship('Favorite_Ship', backref='user', lazy=True)
 
+    # columns returned by the API, also used by the column-tuple read path
+    serialize_fields = ('id', 'email')
+
     def __repr__(self):
         return '<User %r>' % self.email
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-        }
+        return {field: getattr(self, field) for field in self.serialize_fields}
 
 class Character(db.Model):
     __tablename__ = 'character'
+    __table_args__ = (
+        db.Index('ix_character_name_id', 'name', 'id'),
+        db.Index('ix_character_birth_year_id', 'birth_year', 'id'),
+        db.Index('ix_character_gender_id', 'gender', 'id'),
+        db.Index('ix_character_skin_color_id', 'skin_color', 'id'),
+        db.Index('ix_character_eye_color_id', 'eye_color', 'id'),
+        db.Index('ix_character_height_num_id', 'height_num', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
     birth_year = db.Column(db.String(250))
@@ -29,24 +74,36 @@ class Character(db.Model):
     height = db.Column(db.String(250))
     skin_color = db.Column(db.String(250))
     eye_color = db.Column(db.String(250))
+    height_num = db.Column(db.Float)
     favorite_characters = db.relationship('Favorite_Character', backref='character', lazy=True)
 
+    serialize_fields = ('id', 'name', 'birth_year', 'gender', 'height', 'skin_color', 'eye_color')
+    # columns accepted by ?<field>= filters and ?sort=, each backed by a (field, id) index
+    filter_fields = ('name', 'birth_year', 'gender', 'skin_color', 'eye_color')
+    # string stats -> indexed numeric shadow column, used for ?<field>_gt= style range filters and sorting
+    numeric_fields = {'height': 'height_num'}
+
     def __repr__(self):
         return '<Character %r>' % self.name
 
+    @validates('height')
+    def update_numeric_field(self, key, value):
+        setattr(self, self.numeric_fields[key], parse_number(value))
+        return value
+
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "birth_year": self.birth_year,
-            "gender": self.gender,
-            "height": self.height,
-            "skin_color": self.skin_color,
-            "eye_color": self.eye_color
-        }
+        return {field: getattr(self, field) for field in self.serialize_fields}
 
 class Planet(db.Model):
     __tablename__ = 'planet'
+    __table_args__ = (
+        db.Index('ix_planet_name_id', 'name', 'id'),
+        db.Index('ix_planet_climate_id', 'climate', 'id'),
+        db.Index('ix_planet_population_num_id', 'population_num', 'id'),
+        db.Index('ix_planet_orbital_period_num_id', 'orbital_period_num', 'id'),
+        db.Index('ix_planet_rotation_period_num_id', 'rotation_period_num', 'id'),
+        db.Index('ix_planet_diameter_num_id', 'diameter_num', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
     climate = db.Column(db.String(250))
@@ -54,24 +111,39 @@ class Planet(db.Model):
     orbital_period = db.Column(db.String(250))
     rotation_period = db.Column(db.String(250))
     diameter = db.Column(db.String(250))
+    population_num = db.Column(db.Float)
+    orbital_period_num = db.Column(db.Float)
+    rotation_period_num = db.Column(db.Float)
+    diameter_num = db.Column(db.Float)
     favorite_planets = db.relationship('Favorite_Planet', backref='planet', lazy=True)
 
+    serialize_fields = ('id', 'name', 'climate', 'population', 'orbital_period', 'rotation_period', 'diameter')
+    filter_fields = ('name', 'climate')
+    numeric_fields = {
+        'population': 'population_num',
+        'orbital_period': 'orbital_period_num',
+        'rotation_period': 'rotation_period_num',
+        'diameter': 'diameter_num',
+    }
+
     def __repr__(self):
         return '<Planet %r>' % self.name
 
+    @validates('population', 'orbital_period', 'rotation_period', 'diameter')
+    def update_numeric_field(self, key, value):
+        setattr(self, self.numeric_fields[key], parse_number(value))
+        return value
+
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "climate": self.climate,
-            "population": self.population,
-            "orbital_period": self.orbital_period,
-            "rotation_period": self.rotation_period,
-            "diameter": self.diameter
-        }
+        return {field: getattr(self, field) for field in self.serialize_fields}
 
 class Ship(db.Model):
     __tablename__ = 'ship'
+    __table_args__ = (
+        db.Index('ix_ship_name_id', 'name', 'id'),
+        db.Index('ix_ship_model_id', 'model', 'id'),
+        db.Index('ix_ship_manufacturer_id', 'manufacturer', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250))
     model = db.Column(db.String(250))
@@ -80,21 +152,19 @@ class Ship(db.Model):
     crew = db.Column(db.Integer)
     favorite_ships = db.relationship('Favorite_Ship', backref='ship', lazy=True)
 
+    serialize_fields = ('id', 'name', 'model', 'manufacturer', 'cost_in_credits', 'crew')
+    filter_fields = ('name', 'model', 'manufacturer')
+    numeric_fields = {}
+
     def __repr__(self):
         return '<Ship %r>' % self.name
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "model": self.model,
-            "manufacturer": self.manufacturer,
-            "cost_in_credits": self.cost_in_credits,
-            "crew": self.crew,
-        }
+        return {field: getattr(self, field) for field in self.serialize_fields}
 
 class Favorite_Planet(db.Model):
     __tablename__ = 'favorite_planet'
+    __table_args__ = (db.Index('uq_favorite_planet_user_id_planet_id', 'user_id', 'planet_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False)
@@ -104,18 +174,16 @@ class Favorite_Planet(db.Model):
         return '<Favorite_Planet %r>' % self.id
 
     def serialize(self):
-        user = User.query.get(self.user_id)
-        planet = Planet.query.get(self.planet_id)
-        self.description = f"{user.email} likes {planet.name}"
         return {
             "id": self.id,
             "user_id": self.user_id,
             "planet_id": self.planet_id,
-            "description": self.description
+            "description": favorite_description(self, 'planet')
         }
 
 class Favorite_Character(db.Model):
     __tablename__ = 'favorite_character'
+    __table_args__ = (db.Index('uq_favorite_character_user_id_character_id', 'user_id', 'character_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
@@ -125,19 +193,16 @@ class Favorite_Character(db.Model):
         return '<Favorite_Character %r>' % self.id
 
     def serialize(self):
-        user = User.query.get(self.user_id)
-        character = Character.query.get(self.character_id)
-        self.description = f"{user.email} likes {character.name}"
-
         return {
             "id": self.id,
             "user_id": self.user_id,
             "character_id": self.character_id,
-            "description": self.description
+            "description": favorite_description(self, 'character')
         }
 
 class Favorite_Ship(db.Model):
     __tablename__ = 'favorite_ship'
+    __table_args__ = (db.Index('uq_favorite_ship_user_id_ship_id', 'user_id', 'ship_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     ship_id = db.Column(db.Integer, db.ForeignKey('ship.id'), nullable=False)
@@ -147,13 +212,106 @@ class Favorite_Ship(db.Model):
         return '<Favorite_Ship %r>' % self.id
 
     def serialize(self):
-        user = User.query.get(self.user_id)
-        ship = Ship.query.get(self.ship_id)
-        self.description = f"{user.email} likes {ship.name}"
-
         return {
             "id": self.id,
             "user_id": self.user_id,
             "ship_id": self.ship_id,
-            "description": self.description
+            "description": favorite_description(self, 'ship')
         }
+
+class Collection_Version(db.Model):
+    __tablename__ = 'collection_version'
+    name = db.Column(db.String(120), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Collection_Version %r>' % self.name
+
+    @classmethod
+    def current(cls, name):
+        return db.session.query(cls.version).filter_by(name=name).scalar() or 0
+
+    @classmethod
+    def bump(cls, name, session=None):
+        # Runs in the caller's transaction, so the new version is committed together with the change
+        session = session or db.session
+        updated = session.query(cls).filter_by(name=name).update({cls.version: cls.version + 1}, synchronize_session=False)
+        if not updated:
+            session.add(cls(name=name, version=1))
+
+class Popularity(db.Model):
+    __tablename__ = 'popularity'
+    __table_args__ = (db.Index('ix_popularity_kind_favorites_ref_id', 'kind', 'favorites', 'ref_id'),)
+    kind = db.Column(db.String(20), primary_key=True)
+    ref_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    favorites = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Popularity %r %r>' % (self.kind, self.ref_id)
+
+    @classmethod
+    def add(cls, kind, ref_ids, delta):
+        """Atomically add `delta` to the favorite count of every id in `ref_ids`, in the caller's transaction."""
+        if not ref_ids:
+            return
+        statement, rows = cls.add_statement(kind, ref_ids, delta, db.session.get_bind().dialect.name)
+        db.session.execute(statement, rows)
+
+    @classmethod
+    def add_statement(cls, kind, ref_ids, delta, dialect):
+        table = cls.__table__
+        rows = [{'kind': kind, 'ref_id': ref_id, 'favorites': max(delta, 0)} for ref_id in ref_ids]
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert(table) if dialect == 'postgresql' else sqlite.insert(table)
+            statement = insert.on_conflict_do_update(index_elements=['kind', 'ref_id'], set_={'favorites': table.c.favorites + delta})
+        elif dialect == 'mysql':
+            statement = mysql.insert(table).on_duplicate_key_update(favorites=table.c.favorites + delta)
+        else:
+            raise NotImplementedError(f'Popularity.add is not supported for {dialect}')
+        return statement, rows
+
+# type name -> (favorite model, entity model, foreign key column name)
+FAVORITE_TYPES = {
+    'character': (Favorite_Character, Character, 'character_id'),
+    'planet': (Favorite_Planet, Planet, 'planet_id'),
+    'ship': (Favorite_Ship, Ship, 'ship_id'),
+}
+
+def favorite_insert(type, user_id, entity_id, dialect):
+    """INSERT ... SELECT ... ON CONFLICT DO NOTHING of one favorite, returning its id on Postgres."""
+    favorite_model, model, key = FAVORITE_TYPES[type]
+    source = select(User.id, model.id, User.email + ' likes ' + model.name) \
+        .select_from(User.__table__.join(model.__table__, true())) \
+        .where(User.id == user_id, model.id == entity_id)
+    statement = insert_ignore(favorite_model, ['user_id', key], dialect).from_select(['user_id', key, 'description'], source)
+    if dialect == 'postgresql':
+        statement = statement.returning(favorite_model.__table__.c.id)
+    return statement
+
+def changed_collections(session):
+    """Names of the collection versions affected by the pending ORM changes of `session`."""
+    names = set()
+    changed_entities = {}
+    for row in chain(session.new, session.dirty, session.deleted):
+        if row in session.dirty and not session.is_modified(row):
+            continue
+        for type, (favorite_model, model, key) in FAVORITE_TYPES.items():
+            if isinstance(row, model):
+                names.add(type)
+                if row not in session.new:
+                    changed_entities.setdefault(type, set()).add(row.id)
+            elif isinstance(row, favorite_model):
+                names.add(f'user:{row.user_id}:favorites')
+    # the favorites payload embeds the entities, so their users' versions change too
+    for type, ids in changed_entities.items():
+        favorite_model, _, key = FAVORITE_TYPES[type]
+        users = session.query(favorite_model.user_id).filter(getattr(favorite_model, key).in_(ids)).distinct()
+        names.update(f'user:{user_id}:favorites' for user_id, in users)
+    return names
+
+@event.listens_for(Session, 'before_flush')
+def bump_changed_collections(session, flush_context, instances):
+    # every ORM writer (API handlers, Flask-Admin, the ASGI app) goes through here;
+    # Core insert/update/delete statements bypass the flush and bump explicitly
+    for name in sorted(changed_collections(session)):
+        Collection_Version.bump(name, session)
@@ -0,0 +1,142 @@
+"""
+Full-text search over character, planet and ship names.
+
+Each kind has its own `<kind>_search` table keyed by the entity id: an FTS5 virtual
+table on SQLite and a tsvector column with a GIN index on Postgres. The tables are
+created by the migrations, or by db.create_all() through create_tables(), and kept
+in sync by the create and delete routes.
+"""
+import re
+from sqlalchemy import bindparam, event, text
+from models import db
+
+# kind -> (entity table, columns that are searched)
+SEARCH_COLUMNS = {
+    'character': ('character', ('name',)),
+    'planet': ('planet', ('name',)),
+    'ship': ('ship', ('name', 'model', 'manufacturer')),
+}
+
+def dialect():
+    name = db.session.get_bind().dialect.name
+    return name if name in ('sqlite', 'postgresql') else None
+
+def include_object(object, name, type_, reflected, compare_to):
+    # the search tables are created by hand in the migrations, keep autogenerate away from them
+    return not (type_ == 'table' and reflected and '_search' in name)
+
+def tsvector_sql(columns, prefix=''):
+    parts = " || ' ' || ".join(f"coalesce({prefix}{column}, '')" for column in columns)
+    return f"to_tsvector('simple', {parts})"
+
+@event.listens_for(db.metadata, 'after_create')
+def create_tables(target, connection, **kw):
+    """Same tables as the d2b7f0c4e913 migration, for databases built with db.create_all()."""
+    dialect = connection.dialect.name
+    for kind, (table, columns) in SEARCH_COLUMNS.items():
+        names = ', '.join(columns)
+        if dialect == 'sqlite':
+            connection.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {kind}_search USING fts5({names}, prefix='2 3')")
+            connection.exec_driver_sql(
+                f'INSERT INTO {kind}_search (rowid, {names}) SELECT id, {names} FROM {table} t '
+                f'WHERE NOT EXISTS (SELECT 1 FROM {kind}_search s WHERE s.rowid = t.id)'
+            )
+        elif dialect == 'postgresql':
+            connection.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS {kind}_search '
+                f'(id INTEGER PRIMARY KEY, name VARCHAR(250), document TSVECTOR NOT NULL)'
+            )
+            connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{kind}_search_document ON {kind}_search USING gin (document)')
+            connection.exec_driver_sql(
+                f'INSERT INTO {kind}_search (id, name, document) '
+                f'SELECT t.id, t.name, {tsvector_sql(columns, prefix="t.")} FROM {table} t ON CONFLICT (id) DO NOTHING'
+            )
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_tables(target, connection, **kw):
+    if connection.dialect.name in ('sqlite', 'postgresql'):
+        for kind in SEARCH_COLUMNS:
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS {kind}_search')
+
+def index_row(kind, row):
+    """Add or replace the entry of one entity, `row` being the model instance."""
+    if dialect() is None:
+        return
+    _, columns = SEARCH_COLUMNS[kind]
+    params = {column: getattr(row, column) for column in columns}
+    params['id'] = row.id
+    names = ', '.join(columns)
+    values = ', '.join(f':{column}' for column in columns)
+    if dialect() == 'sqlite':
+        db.session.execute(text(f'DELETE FROM {kind}_search WHERE rowid = :id'), params)
+        db.session.execute(text(f'INSERT INTO {kind}_search (rowid, {names}) VALUES (:id, {values})'), params)
+    else:
+        db.session.execute(text(
+            f'INSERT INTO {kind}_search (id, name, document) '
+            f'VALUES (:id, :name, {tsvector_sql([":" + column for column in columns])}) '
+            f'ON CONFLICT (id) DO UPDATE SET name = excluded.name, document = excluded.document'
+        ), params)
+
+def index_new_rows(kind, ids=None):
+    """Index the entities in `ids`, or every entity missing from the index, used after bulk inserts.
+
+    The rows are picked by an anti-join rather than by id order: on Postgres a
+    concurrent transaction may commit higher ids before this one commits lower ones.
+    """
+    if dialect() is None:
+        return
+    table, columns = SEARCH_COLUMNS[kind]
+    names = ', '.join(columns)
+    key = 'rowid' if dialect() == 'sqlite' else 'id'
+    where = f'NOT EXISTS (SELECT 1 FROM {kind}_search s WHERE s.{key} = t.id)'
+    params = {}
+    if ids is not None:
+        if not ids:
+            return
+        where += ' AND t.id IN :ids'
+        params['ids'] = list(ids)
+    if dialect() == 'sqlite':
+        statement = text(
+            f'INSERT INTO {kind}_search (rowid, {names}) SELECT t.id, {", ".join("t." + c for c in columns)} '
+            f'FROM {table} t WHERE {where}'
+        )
+    else:
+        statement = text(
+            f'INSERT INTO {kind}_search (id, name, document) '
+            f'SELECT t.id, t.name, {tsvector_sql(columns, prefix="t.")} FROM {table} t WHERE {where} '
+            f'ON CONFLICT (id) DO NOTHING'
+        )
+    if ids is not None:
+        statement = statement.bindparams(bindparam('ids', expanding=True))
+    db.session.execute(statement, params)
+
+def remove_row(kind, id):
+    if dialect() is None:
+        return
+    key = 'rowid' if dialect() == 'sqlite' else 'id'
+    db.session.execute(text(f'DELETE FROM {kind}_search WHERE {key} = :id'), {'id': id})
+
+def search(query, kinds, limit):
+    """Ranked prefix search, every word of `query` has to match. Higher rank is better."""
+    terms = re.findall(r'\w+', query.lower())
+    if not terms:
+        return []
+
+    results = []
+    for kind in kinds:
+        if dialect() == 'sqlite':
+            match = ' '.join(f'"{term}"*' for term in terms)
+            rows = db.session.execute(text(
+                f'SELECT rowid AS id, name, -bm25({kind}_search) AS rank FROM {kind}_search '
+                f'WHERE {kind}_search MATCH :match ORDER BY rank DESC LIMIT :limit'
+            ), {'match': match, 'limit': limit})
+        else:
+            match = ' & '.join(f'{term}:*' for term in terms)
+            rows = db.session.execute(text(
+                f"SELECT id, name, ts_rank(document, to_tsquery('simple', :match)) AS rank FROM {kind}_search "
+                f"WHERE document @@ to_tsquery('simple', :match) ORDER BY rank DESC LIMIT :limit"
+            ), {'match': match, 'limit': limit})
+        results.extend({"type": kind, "id": row.id, "name": row.name, "rank": row.rank} for row in rows)
+
+    results.sort(key=lambda result: result['rank'], reverse=True)
+    return results[:limit]
@@ -0,0 +1,50 @@
+"""
+Configuration read from the environment, shared by the Flask app and the ASGI entry point.
+"""
+import os
+from database import engine_options
+
+def from_env():
+    config = {}
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
+    else:
+        config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # comma separated replicas for the reads of GET requests, a client's own writes
+    # pin its reads to the primary for DATABASE_REPLICA_STICKY_SECONDS
+    config['DATABASE_REPLICA_URLS'] = [url.strip().replace("postgres://", "postgresql://")
+                                       for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    config['DATABASE_REPLICA_STICKY_SECONDS'] = int(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", 5))
+    config['DATABASE_REPLICA_CHECK_INTERVAL'] = int(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", 10))
+    # seconds a replica health check may take to connect and answer
+    config['DATABASE_REPLICA_CHECK_TIMEOUT'] = float(os.getenv("DATABASE_REPLICA_CHECK_TIMEOUT", 2))
+    config['CACHE_BACKEND'] = os.getenv("CACHE_BACKEND", "sqlite")
+    config['CACHE_URL'] = os.getenv("CACHE_URL")
+    config['CACHE_MAX_ENTRIES'] = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+    config['CACHE_TTL'] = int(os.getenv("CACHE_TTL", 300))
+    config['API_MAX_PAGE_SIZE'] = int(os.getenv("API_MAX_PAGE_SIZE", 100))
+    config['API_STREAM_BATCH_SIZE'] = int(os.getenv("API_STREAM_BATCH_SIZE", 500))
+    config['API_MAX_BULK_SIZE'] = int(os.getenv("API_MAX_BULK_SIZE", 5000))
+    # Server-Timing header with the query count and DB time of each request, and N+1 warnings
+    config['SQL_INSTRUMENTATION'] = os.getenv("SQL_INSTRUMENTATION", "0") == "1"
+    config['SQL_N_PLUS_ONE_THRESHOLD'] = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", 5))
+    # Prometheus metrics at /metrics, needs the prometheus_client package
+    config['METRICS_ENABLED'] = os.getenv("METRICS_ENABLED", "1") == "1"
+    # the /admin views, production workers can skip them with ENABLE_ADMIN=0
+    config['ENABLE_ADMIN'] = os.getenv("ENABLE_ADMIN", "1") == "1"
+    # connection pool of each worker process, ignored for SQLite
+    config['DB_POOL_SIZE'] = int(os.getenv("DB_POOL_SIZE", 5))
+    config['DB_MAX_OVERFLOW'] = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    config['DB_POOL_TIMEOUT'] = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    config['DB_POOL_RECYCLE'] = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    config['DB_POOL_PRE_PING'] = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config)
+    # only used when the database is SQLite, SQLITE_TUNING=0 keeps the driver defaults
+    config['SQLITE_TUNING'] = os.getenv("SQLITE_TUNING", "1") == "1"
+    config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))
+    config['SQLITE_FOREIGN_KEYS'] = os.getenv("SQLITE_FOREIGN_KEYS", "1") == "1"
+    config['SQLITE_CACHE_SIZE'] = int(os.getenv("SQLITE_CACHE_SIZE", -16000))
+    config['SQLITE_MMAP_SIZE'] = int(os.getenv("SQLITE_MMAP_SIZE", 128 * 1024 * 1024))
+    return config
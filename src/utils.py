@@ -1,4 +1,38 @@
-from flask import jsonify, url_for
+import json
+import base64
+import hashlib
+from functools import wraps
+from flask import jsonify, url_for, request, current_app, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import and_, or_
+from models import db, Collection_Version
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used when it is missing
+    orjson = None
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson when it is installed.
+
+    Keys keep the column order of the serialized rows instead of being sorted.
+    """
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +49,271 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def requested_fields(model, args=None):
+    """Columns asked for with ?fields=name,climate, checked against `model.serialize_fields`.
+
+    The id is always included since it identifies the row and is the pagination cursor.
+    `args` defaults to the Flask request's query string.
+    """
+    raw = (request.args if args is None else args).get('fields')
+    if not raw:
+        return model.serialize_fields
+    fields = ['id']
+    for field in raw.split(','):
+        field = field.strip()
+        if field not in model.serialize_fields:
+            raise APIException(f"unknown field {field!r}, expected some of {', '.join(model.serialize_fields)}", status_code=400)
+        if field not in fields:
+            fields.append(field)
+    return tuple(fields)
+
+def requested_ids():
+    """Ids from ?ids=1,2,3 in request order without repeats."""
+    ids = {}
+    for raw in request.args.get('ids', '').split(','):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            ids[int(raw)] = None
+        except ValueError:
+            raise APIException(f'ids must be integers, got {raw!r}', status_code=400)
+    if len(ids) > current_app.config['API_MAX_PAGE_SIZE']:
+        raise APIException(f"at most {current_app.config['API_MAX_PAGE_SIZE']} ids per request", status_code=400)
+    return list(ids)
+
+def project(payload, fields):
+    return {field: payload[field] for field in fields}
+
+def select_fields(model, fields=None):
+    """Query the serialized columns of `model` as plain tuples, skipping ORM instances."""
+    return db.session.query(*[getattr(model, field) for field in fields or model.serialize_fields])
+
+def serialize_rows(rows):
+    if not rows:
+        return []
+    fields = rows[0]._fields
+    if fields[-1] == '_sort':
+        # the sort value paginate() appended for the cursor, zip() stops before it
+        fields = fields[:-1]
+    return [dict(zip(fields, row)) for row in rows]
+
+RANGE_OPERATORS = {
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+}
+
+def apply_filters(query, model, args=None):
+    """Filters from the query string.
+
+    Equality on `model.filter_fields`, e.g. ?eye_color=blue or ?climate=arid&climate=temperate,
+    and ranges on `model.numeric_fields`, e.g. ?population_gt=1e9, which run against the
+    indexed numeric shadow columns. Works on ORM queries and select() statements.
+    """
+    args = request.args if args is None else args
+    for field in model.filter_fields:
+        values = args.getlist(field)
+        if len(values) == 1:
+            query = query.filter(getattr(model, field) == values[0])
+        elif values:
+            query = query.filter(getattr(model, field).in_(values))
+    for field, shadow in model.numeric_fields.items():
+        for operator, compare in RANGE_OPERATORS.items():
+            raw = args.get(f'{field}_{operator}')
+            if raw is None:
+                continue
+            try:
+                value = float(raw)
+            except ValueError:
+                raise APIException(f'{field}_{operator} must be a number', status_code=400)
+            query = query.filter(compare(getattr(model, shadow), value))
+    return query
+
+def sort_order(model, args=None):
+    """Column and direction from ?sort=name or ?sort=-name, defaulting to the id."""
+    raw = (request.args if args is None else args).get('sort', 'id')
+    name = raw.lstrip('-')
+    sortable = ('id',) + model.filter_fields + tuple(model.numeric_fields)
+    if name not in sortable:
+        raise APIException(f"can not sort by {name!r}, expected one of {', '.join(sortable)}", status_code=400)
+    # numeric stats sort by their shadow column so '1000' comes after '200'
+    return getattr(model, model.numeric_fields.get(name, name)), raw.startswith('-')
+
+def order_clauses(key, sort, descending):
+    columns = [key] if sort is None or sort is key else [sort, key]
+    return [column.desc() if descending else column.asc() for column in columns]
+
+def encode_cursor(value, id):
+    return base64.urlsafe_b64encode(json.dumps([value, id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise APIException('invalid after cursor', status_code=400)
+    return value, id
+
+def keyset_filter(key, sort, descending, value, id, dialect=None):
+    """Rows strictly after (value, id) in ORDER BY sort, key.
+
+    NULLs sort low on SQLite and MySQL and high on Postgres, and the condition
+    follows that so the plain (sort, id) indexes can serve the scan.
+    """
+    after_key = key < id if descending else key > id
+    dialect = dialect or db.session.get_bind().dialect.name
+    nulls_first = descending == (dialect == 'postgresql')
+    if value is None:
+        if nulls_first:
+            return or_(sort.isnot(None), and_(sort.is_(None), after_key))
+        return and_(sort.is_(None), after_key)
+    conditions = [sort < value if descending else sort > value, and_(sort == value, after_key)]
+    if not nulls_first:
+        conditions.append(sort.is_(None))
+    return or_(*conditions)
+
+def paginate(query, key, sort=None, descending=False):
+    """Keyset pagination over (`sort`, `key`) using the ?limit= and ?after= query params.
+
+    When sorting by the primary key the cursor is the last id; otherwise it is an
+    opaque token holding the last sort value and id.
+    Returns the page of rows and the cursor for the next page (None on the last page).
+    """
+    max_page_size = current_app.config['API_MAX_PAGE_SIZE']
+    limit = request.args.get('limit', max_page_size, type=int)
+    if limit < 1:
+        raise APIException('limit must be a positive integer', status_code=400)
+    limit = min(limit, max_page_size)
+
+    by_key = sort is None or sort is key
+    after = request.args.get('after')
+    if after is not None and by_key:
+        try:
+            after = int(after)
+        except ValueError:
+            raise APIException('after must be an integer id', status_code=400)
+        query = query.filter(key < after if descending else key > after)
+    elif after is not None:
+        query = query.filter(keyset_filter(key, sort, descending, *decode_cursor(after)))
+
+    if not by_key:
+        query = query.add_columns(sort.label('_sort'))
+    rows = query.order_by(*order_clauses(key, sort, descending)).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if by_key:
+        return rows, getattr(last, key.key)
+    return rows, encode_cursor(last._sort, getattr(last, key.key))
+
+def paginated_response(results, next_cursor):
+    response = jsonify(results)
+    if next_cursor is not None:
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        next_url = url_for(request.endpoint, **(request.view_args or {}), **args)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+def stream_response(query, key, sort=None, descending=False):
+    """Stream every row of `query` as a JSON array (?stream=json) or NDJSON (?stream=ndjson).
+
+    Rows are fetched in batches through a server-side cursor and encoded as they
+    arrive, so memory use does not depend on the size of the table.
+    """
+    stream_format = request.args.get('stream') or 'json'
+    if stream_format not in STREAM_FORMATS:
+        raise APIException(f'stream must be one of {", ".join(STREAM_FORMATS)}', status_code=400)
+
+    rows = query.order_by(*order_clauses(key, sort, descending)).yield_per(current_app.config['API_STREAM_BATCH_SIZE'])
+    dumps = current_app.json.dumps
+
+    def generate_json():
+        yield '['
+        separator = ''
+        for row in rows:
+            yield separator + dumps(dict(zip(row._fields, row)))
+            separator = ','
+        yield ']\n'
+
+    def generate_ndjson():
+        for row in rows:
+            yield dumps(dict(zip(row._fields, row))) + '\n'
+
+    generate = generate_json if stream_format == 'json' else generate_ndjson
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format])
+
+def conditional(collection):
+    """Answer If-None-Match with 304 based on the version counter of `collection`.
+
+    `collection` is formatted with the view arguments, e.g. 'user:{user_id}:favorites'.
+    The ETag is derived from the counter alone, so a matching request never
+    touches the entity tables.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            name = collection.format(**kwargs)
+            etag = f'{name}-{Collection_Version.current(name)}'
+            if request.query_string:
+                etag += '-' + hashlib.md5(request.query_string).hexdigest()[:12]
+
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+def validate_rows(model, items, required):
+    """Check a batch of objects against the serialized columns of `model`.
+
+    Returns a list of {"index", "error"} dicts, empty when every item is valid.
+    """
+    columns = {field: model.__table__.c[field] for field in model.serialize_fields if field != 'id'}
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "error": "item must be an object"})
+            continue
+        missing = [field for field in required if field not in item]
+        if missing:
+            errors.append({"index": index, "error": f"missing fields: {', '.join(missing)}"})
+            continue
+        unknown = [field for field in item if field not in columns]
+        if unknown:
+            errors.append({"index": index, "error": f"unknown fields: {', '.join(unknown)}"})
+            continue
+        if item.get('name') == '':
+            errors.append({"index": index, "error": "name can not be empty"})
+            continue
+        for field, value in item.items():
+            python_type = columns[field].type.python_type
+            if value is not None and (not isinstance(value, python_type) or isinstance(value, bool)):
+                errors.append({"index": index, "error": f"{field} must be of type {python_type.__name__}"})
+                break
+    return errors
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    # Flask-Admin is only registered when ENABLE_ADMIN is on
+    links = ['/admin/'] if 'admin' in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
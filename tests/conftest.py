@@ -0,0 +1,70 @@
+"""
+The app reads its settings from the environment on import, so they are set here
+before any test module imports it. Every test runs against a fresh SQLite file
+created from the models, including the full-text search tables.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+DATABASE = os.path.join(tempfile.mkdtemp(prefix='api-tests-'), 'test.db')
+
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+os.environ['CACHE_BACKEND'] = 'memory'
+os.environ['ENABLE_ADMIN'] = '0'
+os.environ['METRICS_ENABLED'] = '0'
+# registers the read-your-writes cookie; the replica set itself is taken out below
+# and only put back by the tests that use the `replicas` fixture
+os.environ['DATABASE_REPLICA_URLS'] = f'sqlite:///{os.path.join(os.path.dirname(DATABASE), "replica.db")}'
+sys.path.insert(0, SRC)
+
+from flask.testing import FlaskClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from app import app as flask_app, cache  # noqa: E402
+from models import db  # noqa: E402
+
+flask_app.extensions.pop('replicas')
+
+class RequestClient(FlaskClient):
+    """Test client giving every request a new session.
+
+    The `app` fixture keeps an app context open for the whole test, which requests
+    reuse, while in production each request pushes its own and so gets its own session.
+    """
+
+    def open(self, *args, **kwargs):
+        db.session.remove()
+        return super().open(*args, **kwargs)
+
+flask_app.test_client_class = RequestClient
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.engine.dispose()
+    cache.clear()
+    for path in (DATABASE, DATABASE + '-wal', DATABASE + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def statements(app):
+    """SQL statements sent to the database while the test runs."""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
@@ -0,0 +1,121 @@
+"""
+Cache backends, with a fake clock so expiry and LRU order don't depend on timing.
+"""
+import pytest
+from cache import LRUCache, SQLiteCache
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_entries=2, ttl=60, clock=Clock())
+    cache.set('character:1', {'id': 1})
+    cache.set('character:2', {'id': 2})
+    assert cache.get('character:1') == {'id': 1}
+
+    cache.set('character:3', {'id': 3})
+
+    assert cache.get('character:2') is None
+    assert cache.get('character:1') == {'id': 1}
+    assert cache.get('character:3') == {'id': 3}
+    assert cache.stats()['evictions'] == 1
+
+def test_lru_never_holds_more_than_max_entries():
+    cache = LRUCache(max_entries=3, ttl=60, clock=Clock())
+    for id in range(10):
+        cache.set(f'ship:{id}', {'id': id})
+
+    assert cache.stats()['size'] == 3
+    assert cache.get_many([f'ship:{id}' for id in range(10)]) == {f'ship:{id}': {'id': id} for id in (7, 8, 9)}
+
+def test_lru_entries_expire_after_the_ttl():
+    clock = Clock()
+    cache = LRUCache(max_entries=10, ttl=60, clock=clock)
+    cache.set('planet:1', {'id': 1})
+
+    clock.now += 59
+    assert cache.get('planet:1') == {'id': 1}
+    clock.now += 1
+    assert cache.get('planet:1') is None
+    stats = cache.stats()
+    assert (stats['size'], stats['expirations'], stats['hits'], stats['misses']) == (0, 1, 1, 1)
+
+def test_lru_skips_none_and_loads_misses_once():
+    cache = LRUCache(max_entries=10, ttl=60, clock=Clock())
+    cache.set('user:1', None)
+    assert cache.stats()['size'] == 0
+
+    loads = []
+    def loader():
+        loads.append(1)
+        return {'id': 2}
+
+    assert cache.get_or_load('user:2', loader) == {'id': 2}
+    assert cache.get_or_load('user:2', loader) == {'id': 2}
+    assert len(loads) == 1
+    cache.delete('user:2')
+    assert cache.get('user:2') is None
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'cache.sqlite3')
+
+def test_sqlite_evicts_the_least_recently_read_entry(cache_path):
+    clock = Clock()
+    cache = SQLiteCache(cache_path, max_entries=2, ttl=60, clock=clock)
+    cache.set('character:1', {'id': 1})
+    clock.now += 1
+    cache.set('character:2', {'id': 2})
+    # reads only refresh the LRU time once it is older than TOUCH_INTERVAL
+    clock.now += SQLiteCache.TOUCH_INTERVAL + 1
+    assert cache.get('character:1') == {'id': 1}
+
+    clock.now += 1
+    cache.set('character:3', {'id': 3})
+
+    assert cache.get('character:2') is None
+    assert cache.get_many(['character:1', 'character:3']) == {'character:1': {'id': 1}, 'character:3': {'id': 3}}
+    assert cache.stats()['size'] == 2
+
+def test_sqlite_entries_expire_after_the_ttl(cache_path):
+    clock = Clock()
+    cache = SQLiteCache(cache_path, max_entries=10, ttl=60, clock=clock)
+    cache.set('planet:1', {'id': 1})
+
+    clock.now += 60
+    assert cache.get('planet:1') is None
+    assert cache.get_many(['planet:1']) == {}
+    assert cache.stats()['size'] == 0
+
+def test_sqlite_writes_are_seen_by_other_instances_on_the_file(cache_path):
+    # each instance has its own connection, like two worker processes
+    first = SQLiteCache(cache_path, max_entries=10, ttl=60)
+    second = SQLiteCache(cache_path, max_entries=10, ttl=60)
+    first.set('ship:1', {'id': 1})
+    assert second.get('ship:1') == {'id': 1}
+
+    second.delete('ship:1')
+
+    assert first.get('ship:1') is None
+
+def test_sqlite_stats_sum_the_counters_of_every_instance(cache_path):
+    first = SQLiteCache(cache_path, max_entries=10, ttl=60)
+    second = SQLiteCache(cache_path, max_entries=10, ttl=60)
+    first.set('user:1', {'id': 1})
+    first.get('user:1')
+    first.get('user:2')
+    second.get('user:1')
+    second.get_many(['user:1', 'user:3'])
+    # the other instance adds its counts at its next flush
+    second.flush_counters()
+
+    stats = first.stats()
+
+    assert (stats['hits'], stats['misses']) == (3, 2)
+    assert (second.stats()['hits'], second.stats()['misses']) == (3, 2)
+    # the per-process counters exported to /metrics stay separate
+    assert (first.hits, first.misses, second.hits, second.misses) == (1, 1, 2, 1)
@@ -0,0 +1,49 @@
+"""
+POST /user/<id>/favorites/batch writes each favorite type with one statement, so the
+number of queries does not grow with the size of the batch.
+"""
+from models import db, User, Character, Planet, Ship, Popularity
+
+def add_entities(count):
+    db.session.add(User(email='batch@example.com', password='secret', is_active=True))
+    for index in range(count):
+        db.session.add_all([Character(name=f'character {index}'), Planet(name=f'planet {index}'), Ship(name=f'ship {index}')])
+    db.session.commit()
+
+def items(ids):
+    return [{'type': type, 'id': id} for type in ('character', 'planet', 'ship') for id in ids]
+
+def batch(client, statements, body):
+    statements.clear()
+    response = client.post('/user/1/favorites/batch', json=body)
+    assert response.status_code == 200, response.json
+    return len(statements), response.json
+
+def test_batch_query_count_does_not_depend_on_the_batch_size(client, statements):
+    add_entities(45)
+    # the first batch also creates the user's collection version row
+    batch(client, statements, {'add': items([45])})
+
+    small_add, _ = batch(client, statements, {'add': items(range(1, 3))})
+    large_add, added = batch(client, statements, {'add': items(range(3, 43))})
+    small_remove, _ = batch(client, statements, {'remove': items(range(1, 3))})
+    large_remove, removed = batch(client, statements, {'remove': items(range(3, 43))})
+
+    assert added['added']['ship'] == list(range(3, 43))
+    assert removed['removed']['ship'] == list(range(3, 43))
+    assert small_add == large_add
+    assert small_remove == large_remove
+
+def test_batch_reports_what_actually_changed(client):
+    add_entities(5)
+    client.post('/user/1/favorites/batch', json={'add': items([1, 2])})
+
+    response = client.post('/user/1/favorites/batch', json={'add': items([2, 3]), 'remove': items([4, 1])})
+
+    assert response.json == {
+        'added': {type: [3] for type in ('character', 'planet', 'ship')},
+        'skipped': {type: [2] for type in ('character', 'planet', 'ship')},
+        'removed': {type: [1] for type in ('character', 'planet', 'ship')},
+    }
+    favorites = dict(db.session.query(Popularity.ref_id, Popularity.favorites).filter_by(kind='ship'))
+    assert favorites == {1: 0, 2: 1, 3: 1}
@@ -0,0 +1,46 @@
+"""
+GET /user/<id>/favorites loads the user, its favorites and their entities with a
+fixed number of queries, however many favorites the user has.
+"""
+from models import db, User, Character, Planet, Ship, Favorite_Character, Favorite_Planet, Favorite_Ship
+
+def add_user_with_favorites(email, count):
+    user = User(email=email, password='secret', is_active=True)
+    db.session.add(user)
+    for index in range(count):
+        character = Character(name=f'{email} character {index}')
+        planet = Planet(name=f'{email} planet {index}')
+        ship = Ship(name=f'{email} ship {index}')
+        db.session.add_all([
+            Favorite_Character(user=user, character=character, description='-'),
+            Favorite_Planet(user=user, planet=planet, description='-'),
+            Favorite_Ship(user=user, ship=ship, description='-'),
+        ])
+    db.session.commit()
+    return user.id
+
+def count_statements(client, statements, user_id):
+    statements.clear()
+    response = client.get(f'/user/{user_id}/favorites')
+    assert response.status_code == 200
+    return len(statements), response.json
+
+def test_favorites_query_count_does_not_depend_on_the_number_of_favorites(client, statements):
+    few = add_user_with_favorites('few@example.com', 2)
+    many = add_user_with_favorites('many@example.com', 60)
+
+    few_queries, few_payload = count_statements(client, statements, few)
+    many_queries, many_payload = count_statements(client, statements, many)
+
+    assert [len(few_payload[type]) for type in ('character', 'planet', 'ship')] == [2, 2, 2]
+    assert [len(many_payload[type]) for type in ('character', 'planet', 'ship')] == [60, 60, 60]
+    assert few_queries == many_queries
+
+def test_favorites_serialize_the_entities_without_lazy_loads(client, statements):
+    user_id = add_user_with_favorites('lazy@example.com', 3)
+
+    queries, payload = count_statements(client, statements, user_id)
+
+    assert {favorite['name'] for favorite in payload['ship']} == {f'lazy@example.com ship {index}' for index in range(3)}
+    # the ETag lookup, the user, then one query per favorite type with its entities joined in
+    assert queries == 5
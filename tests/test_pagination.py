@@ -0,0 +1,55 @@
+"""
+Keyset pagination walks every row exactly once in ORDER BY sort, id, including rows
+whose sort value is NULL (which SQLite sorts first in ascending order).
+"""
+import pytest
+from models import db, Planet, Ship
+
+def walk(client, url):
+    """Follow the Link: rel="next" headers, returning the ids of every page."""
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, response.json
+        pages.append([row['id'] for row in response.json])
+        link = response.headers.get('Link')
+        url = link[1:link.index('>')] if link else None
+    return pages
+
+def expected_ids(rows, value, descending=False):
+    def key(row):
+        # NULLs first, then by value, ties by id
+        current = value(row)
+        return (0, 0, row.id) if current is None else (1, current, row.id)
+    ordered = sorted(rows, key=key)
+    return [row.id for row in (reversed(ordered) if descending else ordered)]
+
+@pytest.fixture
+def ships(app):
+    names = [None, 'b', None, 'a', 'b', None, 'c', 'a', None, 'b']
+    rows = [Ship(name=name, model=f'model {index}') for index, name in enumerate(names)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+@pytest.mark.parametrize('sort', ['name', '-name'])
+@pytest.mark.parametrize('limit', [1, 2, 3, 4])
+def test_sorted_pages_cover_null_values_once(client, ships, sort, limit):
+    expected = expected_ids(ships, lambda row: row.name, descending=sort.startswith('-'))
+
+    pages = walk(client, f'/ship?sort={sort}&limit={limit}')
+
+    ids = [id for page in pages for id in page]
+    assert all(len(page) <= limit for page in pages)
+    assert ids == expected
+
+def test_numeric_sort_pages_past_unparsable_values(client, app):
+    populations = ['unknown', '1,000', '200', None, '1000', 'unknown', '30']
+    planets = [Planet(name=f'planet {index}', population=population) for index, population in enumerate(populations)]
+    db.session.add_all(planets)
+    db.session.commit()
+    expected = expected_ids(planets, lambda row: row.population_num)
+
+    ids = [id for page in walk(client, '/planet?sort=population&limit=2') for id in page]
+
+    assert ids == expected
@@ -0,0 +1,63 @@
+"""
+Read replicas with two SQLite files: the replica is a separate database that the
+tests fill by hand, so whatever a request returns shows where it was read from.
+"""
+import pytest
+from sqlalchemy import create_engine
+from database import ReplicaSet, STICKY_COOKIE
+from models import db, Character
+
+CHARACTER = {'name': 'Luke', 'birth_year': '19BBY', 'gender': 'male', 'height': '172', 'skin_color': 'fair', 'eye_color': 'blue'}
+
+@pytest.fixture
+def replica(app, tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "replica.db"}')
+    db.metadata.create_all(engine)
+    unreachable = create_engine(f'sqlite:///{tmp_path / "missing" / "replica.db"}')
+    app.extensions['replicas'] = ReplicaSet([unreachable, engine])
+    yield engine
+    app.extensions.pop('replicas')
+    engine.dispose()
+
+def add_character(engine, name):
+    with engine.begin() as connection:
+        return connection.execute(Character.__table__.insert().values(name=name)).inserted_primary_key[0]
+
+def names(client, path='/character'):
+    return [row['name'] for row in client.get(path).json]
+
+def test_reads_go_to_a_healthy_replica(client, replica):
+    add_character(db.engine, 'on the primary')
+    add_character(replica, 'on the replica')
+
+    assert names(client) == ['on the replica']
+    assert names(client) == ['on the replica']
+    # the unreachable replica is skipped, and reported as such
+    assert [replica['healthy'] for replica in client.get('/stats').json['replicas']] == [False, True]
+
+def test_writes_pin_the_client_to_the_primary(client, app, replica):
+    add_character(replica, 'on the replica')
+
+    response = client.post('/character', json=CHARACTER)
+
+    assert STICKY_COOKIE in response.headers['Set-Cookie']
+    assert names(client) == ['Luke']
+    assert names(app.test_client()) == ['on the replica']
+
+def test_cache_misses_load_from_the_primary(client, app, replica):
+    # character 1 exists on both, the replica has not seen its deletion yet
+    add_character(db.engine, 'Leia')
+    add_character(replica, 'Leia')
+    other = app.test_client()
+
+    assert client.delete('/character/1').status_code == 200
+    assert other.get('/character/1').status_code == 404
+    assert other.get('/character?ids=1').json == {'results': [], 'missing': [1]}
+    assert client.get('/character/1').status_code == 404
+
+def test_cached_payloads_come_from_the_primary(app, replica):
+    add_character(db.engine, 'primary name')
+    add_character(replica, 'stale name')
+
+    assert app.test_client().get('/character/1').json['name'] == 'primary name'
+    assert app.test_client().get('/character?ids=1').json['results'][0]['name'] == 'primary name'
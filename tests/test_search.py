@@ -0,0 +1,42 @@
+"""
+The create, bulk create and delete routes keep the search index in sync, on a
+database built with db.create_all().
+"""
+from models import db, Planet
+
+def search(client, query, type=None):
+    response = client.get('/search', query_string={'q': query, **({'type': type} if type else {})})
+    assert response.status_code == 200, response.json
+    return [(result['type'], result['name']) for result in response.json]
+
+def test_created_and_deleted_rows_are_searchable(client):
+    response = client.post('/character', json={'name': 'Luke Skywalker', 'birth_year': '19BBY', 'gender': 'male',
+                                               'height': '172', 'skin_color': 'fair', 'eye_color': 'blue'})
+    assert response.status_code == 200
+    response = client.post('/ship/bulk', json=[
+        {'name': 'X-wing', 'model': 'T-65', 'manufacturer': 'Incom', 'cost_in_credits': 149999, 'crew': 1},
+        {'name': 'Y-wing', 'model': 'BTL', 'manufacturer': 'Koensayr', 'cost_in_credits': 134999, 'crew': 2},
+    ])
+    assert response.status_code == 201
+    response = client.post('/planet', json={'name': 'Tatooine', 'climate': 'arid', 'population': '200000',
+                                            'orbital_period': '304', 'rotation_period': '23', 'diameter': '10465'})
+    assert response.status_code == 200
+
+    assert search(client, 'sky') == [('character', 'Luke Skywalker')]
+    assert search(client, 'incom') == [('ship', 'X-wing')]
+    assert sorted(search(client, 'wing', 'ship')) == [('ship', 'X-wing'), ('ship', 'Y-wing')]
+    assert search(client, 'tato') == [('planet', 'Tatooine')]
+
+    character_id = client.get('/character').json[0]['id']
+    assert client.delete(f'/character/{character_id}').status_code == 200
+    assert search(client, 'sky') == []
+
+def test_create_all_indexes_existing_rows(app, client):
+    db.session.add(Planet(name='Hoth', climate='frozen'))
+    db.session.commit()
+    db.session.execute(db.text('DELETE FROM planet_search'))
+    db.session.commit()
+
+    db.create_all()
+
+    assert search(client, 'hoth') == [('planet', 'Hoth')]